@@ -0,0 +1,117 @@
+import threading
+import datetime
+import time
+
+def parse_rate(rate):
+    # converts a rate in bytes per second to an integer, a 'k' or 'M' suffix multiplies by 1024 or
+    # 1024*1024. An empty rate or 0 means unlimited
+    rate = str(rate).strip()
+    if not rate:
+        return 0
+    multiplier = 1
+    if rate[-1] in 'kK':
+        multiplier = 1024
+        rate = rate[:-1]
+    elif rate[-1] in 'mM':
+        multiplier = 1024 * 1024
+        rate = rate[:-1]
+    return int(float(rate) * multiplier)
+
+def parse_schedule(schedule):
+    # converts a schedule such as '09:00-17:30=500k, 17:30-09:00=0' to a list of
+    # (start minute, end minute, rate) tuples. A period may run past midnight
+    periods = []
+    for period in schedule.split(','):
+        if not period.strip():
+            continue
+        times, rate = period.split('=')
+        start, end = times.split('-')
+        periods.append((minute_of_day(start), minute_of_day(end), parse_rate(rate)))
+    return periods
+
+def minute_of_day(clock_time):
+    # converts a time in the format 'HH:MM' to the number of minutes since midnight
+    clock_time = datetime.datetime.strptime(clock_time.strip(), '%H:%M').time()
+    return clock_time.hour * 60 + clock_time.minute
+
+class Token_Bucket():
+    """ Limits the rate bytes are taken at across every thread sharing the bucket. The bucket refills
+        at the rate and holds at most one second of tokens, taking more than is available leaves the
+        bucket in debt and the taker sleeps until the debt would have been refilled. A rate of 0 is
+        unlimited """
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        # change the rate, tokens already taken at the old rate are kept
+        with self.lock:
+            if rate == self.rate:
+                return
+            self.refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def refill(self):
+        # add the tokens for the time since the last refill, must be called holding the lock
+        now = time.time()
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        # take amount tokens, sleeping until the bucket has refilled enough to pay for them
+        with self.lock:
+            if not self.rate:
+                return
+            self.refill()
+            self.tokens -= amount
+            wait = -self.tokens / float(self.rate) if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class Bandwidth_Limiter():
+    """ Limits the download rate of every stream in a batch. The global rate is shared by all
+        download workers through one token bucket and each stream can also be capped on its own.
+        The schedule replaces the global rate during the periods it lists """
+    def __init__(self, rate=0, stream_rate=0, schedule=None):
+        self.rate = rate
+        self.stream_rate = stream_rate
+        self.schedule = schedule or []
+        self.bucket = Token_Bucket(self.get_scheduled_rate())
+        self.checked = time.time()
+
+    def get_scheduled_rate(self, now=None):
+        # returns the global rate that applies at the given time, the current time by default
+        now = now or datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if start <= end and start <= minute < end:
+                return rate
+            if start > end and (minute >= start or minute < end):
+                return rate
+        return self.rate
+
+    def is_limited(self):
+        # checks if any download can be slowed down by the limiter
+        return bool(self.rate or self.stream_rate or self.schedule)
+
+    def create_throttle(self):
+        # returns a function for a single download to call with the size of every chunk it receives,
+        # or None when downloads are never limited
+        if not self.is_limited():
+            return None
+        stream_bucket = Token_Bucket(self.stream_rate)
+        def throttle(amount):
+            stream_bucket.consume(amount)
+            self.consume(amount)
+        return throttle
+
+    def consume(self, amount):
+        # take amount bytes from the global bucket, the schedule is checked at most once a second
+        if self.schedule and time.time() - self.checked >= 1:
+            self.checked = time.time()
+            self.bucket.set_rate(self.get_scheduled_rate())
+        self.bucket.consume(amount)
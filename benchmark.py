@@ -0,0 +1,413 @@
+import contextlib
+import argparse
+import threading
+import tempfile
+import shutil
+import random
+import struct
+import types
+import wave
+import io
+import json
+import math
+import time
+import sys
+import os
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+
+# the benchmark never contacts youtube, a stand-in for pafy is installed before the streams module
+# imports the real one
+sys.modules['pafy'] = types.ModuleType('pafy')
+
+from settings import Settings_Parser
+from metadata_cache import Cached_Video, extract_video_id
+from streams import Stream_Generator
+from file_names import File_Names
+from downloads import Download_Queue
+from bandwidth import Bandwidth_Limiter, parse_rate
+from retry import Retry_Policy
+from convert_scheduler import Convert_Scheduler
+import streams
+
+SETTINGS_FILE = os.getcwd() + "/settings.ini"
+
+class Fake_Stream():
+    """ Stands in for a pafy stream, the stream is downloaded from the local media server """
+    def __init__(self, title, url, extension, mediatype, resolution, bitrate, rawbitrate, size):
+        self.title = title
+        self.url = url
+        self.extension = extension
+        self.mediatype = mediatype
+        self.resolution = resolution
+        self.bitrate = bitrate
+        self.rawbitrate = rawbitrate
+        self.size = size
+
+    def get_filesize(self):
+        # returns the size of the stream in bytes
+        return self.size
+
+class Fake_Video(Cached_Video):
+    """ Stands in for a pafy object. The streams are built from the media served by the local
+        server, the stream selection is inherited from the cached video which mirrors pafy """
+    def __init__(self, video_id, duration, stream_list):
+        self.videoid = video_id
+        self.title = "Benchmark video %s" %video_id
+        self.duration = duration
+        self.published = "2017-01-01 00:00:00"
+        self.allstreams = [Fake_Stream(self.title, *stream_meta) for stream_meta in stream_list]
+        self.streams = [s for s in self.allstreams if s.mediatype == "normal"]
+        self.audiostreams = [s for s in self.allstreams if s.mediatype == "audio"]
+        self.videostreams = [s for s in self.allstreams if s.mediatype == "video"]
+
+class Fake_Pafy():
+    """ Replaces pafy.new, every video has the same duration and streams and the lookup takes a
+        fixed time to stand in for the round trip to youtube """
+    def __init__(self, server, duration="00:00:10", lookup_latency=0.0):
+        self.server = server
+        self.duration = duration
+        self.lookup_latency = lookup_latency
+
+    def new(self, url):
+        # returns a fake video for the URL
+        time.sleep(self.lookup_latency)
+        video_id = extract_video_id(url)
+        if not video_id:
+            raise ValueError("Need 11 character video id or the URL of the video. Got %s" %url)
+        return Fake_Video(video_id, self.duration, self.get_stream_list(video_id))
+
+    def get_stream_list(self, video_id):
+        # returns the meta of every stream the media server provides for the video
+        stream_list = []
+        for path, (extension, mediatype, resolution, bitrate, rawbitrate) in self.server.stream_types.items():
+            url = "http://127.0.0.1:%s%s?v=%s" %(self.server.port, path, video_id)
+            stream_list.append((url, extension, mediatype, resolution, bitrate, rawbitrate,
+                                len(self.server.media[path])))
+        return stream_list
+
+class Media_Handler(http.server.BaseHTTPRequestHandler):
+    """ Serves the media registered with the server, supporting range requests. The bandwidth,
+        latency and failures of a real server are simulated """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # send the requested media or the requested range of it
+        server = self.server
+        body = server.media.get(self.path.split('?')[0])
+        if body is None:
+            self.send_error(404)
+            return
+        time.sleep(server.latency)
+        if server.should_fail():
+            self.send_error(503)
+            return
+        start, end = self.get_range(len(body))
+        if start is None:
+            self.send_response(200)
+            start, end = 0, len(body) - 1
+        else:
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %s-%s/%s" %(start, end, len(body)))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        # drop the connection part way through the body of a failed request
+        cut = end + 1
+        if server.should_fail():
+            cut = start + (end - start + 1) // 2
+            self.close_connection = True
+        try:
+            self.write_throttled(body, start, cut)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def get_range(self, size):
+        # returns the first and last byte of the requested range, or None when the whole body was requested
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes="):
+            return None, None
+        first, last = header[len("bytes="):].split("-")
+        return int(first), min(int(last), size - 1) if last else size - 1
+
+    def write_throttled(self, body, start, end):
+        # write the body in chunks, pausing between chunks to keep to the bandwidth limit
+        chunk_size = 16384
+        started = time.time()
+        position = start
+        while position < end:
+            chunk = body[position:min(position + chunk_size, end)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+            if self.server.bandwidth:
+                delay = (position - start) / float(self.server.bandwidth) - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, format, *args):
+        # keep the benchmark output free of request logs
+        pass
+
+class Media_Server(http.server.ThreadingHTTPServer):
+    """ Local HTTP server for the benchmark's media. bandwidth is in bytes per second per connection
+        (0 is unlimited), latency is added before every response and failure_rate is the chance of a
+        request failing with a 503 or being cut off part way through """
+    daemon_threads = True
+
+    def __init__(self, bandwidth=0, latency=0.0, failure_rate=0.0, seed=0):
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), Media_Handler)
+        self.port = self.server_address[1]
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.media = {}
+        self.stream_types = {}
+
+    def add_stream(self, path, body, extension, mediatype, resolution, bitrate=None, rawbitrate=None):
+        # serve the body at the path as a stream of a fake video
+        self.media[path] = body
+        self.stream_types[path] = (extension, mediatype, resolution, bitrate, rawbitrate)
+
+    def should_fail(self):
+        # randomly decide whether to inject a failure
+        if not self.failure_rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.failure_rate
+
+    def start(self):
+        # serve requests in a background thread
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+def generate_media(seconds, sample_rate=8000):
+    # returns a small mono wav file holding a sine wave, ffmpeg can convert it like a real stream
+    media_file = io.BytesIO()
+    with contextlib.closing(wave.open(media_file, 'wb')) as media:
+        media.setnchannels(1)
+        media.setsampwidth(2)
+        media.setframerate(sample_rate)
+        samples = [int(8000 * math.sin(2 * math.pi * 440 * n / sample_rate))
+                   for n in range(int(seconds * sample_rate))]
+        media.writeframes(struct.pack('<%sh' %len(samples), *samples))
+    return media_file.getvalue()
+
+def percentile(values, percent):
+    # returns the nearest rank percentile of the values, None when there are no values
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[max(0, rank)]
+
+def summarise_stage(latencies, elapsed, items, size=0):
+    # returns the throughput and latency figures of one stage
+    return {"items": items,
+            "elapsed": round(elapsed, 3),
+            "items_per_second": round(items / elapsed, 2) if elapsed else None,
+            "mb_per_second": round(size / 1048576.0 / elapsed, 2) if elapsed and size else None,
+            "p50": round(percentile(latencies, 50), 4) if latencies else None,
+            "p95": round(percentile(latencies, 95), 4) if latencies else None,
+            "errors": items - len(latencies)}
+
+class Benchmark():
+    """ Runs a number of fake videos through the resolve, download and convert stages and measures
+        the throughput and latency of each stage """
+    def __init__(self, settings, server, chosen_format, workers=None, convert_workers=None,
+                 resolve_workers=None, bandwidth_limiter=None):
+        self.settings = settings
+        self.bandwidth_limiter = bandwidth_limiter
+        self.server = server
+        self.chosen_format = chosen_format
+        self.workers = workers or settings.get_download_workers()
+        self.convert_workers = convert_workers or settings.get_convert_workers()
+        self.resolve_workers = resolve_workers or settings.get_resolve_workers()
+
+    def run(self, count):
+        # run count videos through every stage, returns the figures for each stage
+        download_dir = tempfile.mkdtemp(prefix="youtube_downloader_benchmark_")
+        try:
+            stream_list, resolve = self.run_resolve(count, download_dir)
+            download, convert = self.run_download(stream_list)
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+        return {"items": count, "resolve": resolve, "download": download, "convert": convert}
+
+    def run_resolve(self, count, download_dir):
+        # generate a stream for each video, returns the streams that resolved and the stage figures
+        format_type = self.settings.get_format_type(self.chosen_format)
+        file_names = File_Names()
+        stream_list = [Stream_Generator("https://www.youtube.com/watch?v=bench%06d" %number, "", "",
+                                        format_type, self.chosen_format, download_dir,
+                                        file_names=file_names)
+                       for number in range(count)]
+        latencies = []
+        def resolve(stream):
+            started = time.time()
+            stream.generate()
+            if not stream.get_errors():
+                latencies.append(time.time() - started)
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.resolve_workers) as executor:
+            list(executor.map(resolve, stream_list))
+        elapsed = time.time() - started
+        resolved = [stream for stream in stream_list if not stream.get_errors()]
+        return resolved, summarise_stage(latencies, elapsed, count)
+
+    def run_download(self, stream_list):
+        # download and convert the streams with the download queue, returns the figures of both stages
+        timings = dict((position, {}) for position in range(len(stream_list)))
+        finished = threading.Event()
+        def status_changed(position, status):
+            # a retried stream is timed from its first attempt
+            timings[position].setdefault(status, time.time())
+        download_queue = Download_Queue(stream_list,
+                                        workers=self.workers,
+                                        convert_workers=self.convert_workers,
+                                        exact_trim=self.settings.get_exact_trim(),
+                                        pipe_convert_formats=self.settings.get_pipe_convert_formats(),
+                                        segments=self.settings.get_download_segments(),
+                                        partial_fetch_margin=self.settings.get_partial_fetch_margin(),
+                                        bandwidth_limiter=self.bandwidth_limiter,
+                                        retry_policy=Retry_Policy(self.settings.get_retry_max_attempts(),
+                                                                  self.settings.get_retry_base_delay(),
+                                                                  self.settings.get_retry_max_delay(),
+                                                                  self.settings.get_retry_max_url_refreshes()),
+                                        convert_scheduler=Convert_Scheduler(self.convert_workers,
+                                                                            self.settings.get_convert_niceness()),
+                                        status_callback=status_changed,
+                                        finished_callback=finished.set)
+        started = time.time()
+        # keep the ffmpeg commands printed by the conversions out of the results
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                download_queue.start()
+                finished.wait()
+        download_latencies = []
+        convert_latencies = []
+        download_size = 0
+        download_ended = started
+        convert_started = []
+        convert_ended = []
+        convert_count = 0
+        for position, timing in timings.items():
+            stream = stream_list[position]
+            # streams converted while they download(piped) are only timed as downloads
+            downloaded = timing.get('Queued for conversion', timing.get('Done'))
+            if 'Downloading' in timing and downloaded:
+                download_latencies.append(downloaded - timing['Downloading'])
+                download_size += stream.get_stream().get_filesize()
+                download_ended = max(download_ended, downloaded)
+            if 'Queued for conversion' in timing or 'Error during converting' in timing:
+                convert_count += 1
+            if 'Converting' in timing and 'Done' in timing:
+                convert_latencies.append(timing['Done'] - timing['Converting'])
+                convert_started.append(timing['Converting'])
+                convert_ended.append(timing['Done'])
+        download = summarise_stage(download_latencies, download_ended - started, len(stream_list),
+                                   download_size)
+        convert = None
+        if convert_count:
+            elapsed = max(convert_ended) - min(convert_started) if convert_started else 0
+            convert = summarise_stage(convert_latencies, elapsed, convert_count)
+        return download, convert
+
+def build_server(options):
+    # start the media server with a synthetic video stream and a generated audio stream
+    server = Media_Server(bandwidth=options.bandwidth * 1024, latency=options.latency,
+                          failure_rate=options.failure_rate, seed=options.seed)
+    server.add_stream('/normal.mp4', os.urandom(options.stream_size * 1024), 'mp4', 'normal', '640x360')
+    server.add_stream('/audio.m4a', generate_media(options.duration), 'm4a', 'audio', '0x0',
+                      '128k', 128000)
+    server.start()
+    return server
+
+def parse_arguments(args):
+    # returns the parsed command line arguments
+    parser = argparse.ArgumentParser(description="Measure the throughput of the download pipeline against a local fake backend.")
+    parser.add_argument("--sizes", default="1,10,100,1000",
+                        help="comma separated numbers of videos to run through the pipeline")
+    parser.add_argument("-f", "--format", dest="chosen_format", default="mp4",
+                        help="format to download, mp4 is downloaded as it is, audio formats such as mp3 are converted with ffmpeg")
+    parser.add_argument("--stream-size", type=int, default=256,
+                        help="size in kB of the synthetic video stream")
+    parser.add_argument("--duration", type=int, default=5,
+                        help="length in seconds of the generated audio stream")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="bandwidth of each connection in kB/s, 0 is unlimited")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added before every response of the media server")
+    parser.add_argument("--lookup-latency", type=float, default=0.0,
+                        help="seconds every video lookup takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="chance of a media request failing or being cut off")
+    parser.add_argument("--max-rate",
+                        help="combined download rate limit in bytes/s('k' and 'M' suffixes allowed), defaults to the settings")
+    parser.add_argument("--max-stream-rate",
+                        help="download rate limit of each stream in bytes/s, defaults to the settings")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the injected failures")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="number of streams to download at the same time")
+    parser.add_argument("-c", "--convert-workers", type=int,
+                        help="number of ffmpeg conversions to run at the same time")
+    parser.add_argument("-r", "--resolve-workers", type=int,
+                        help="number of URLs to look up at the same time")
+    parser.add_argument("--settings", default=SETTINGS_FILE,
+                        help="path of the settings file")
+    parser.add_argument("--json", dest="json_path",
+                        help="path to also write the results to as JSON")
+    return parser.parse_args(args)
+
+def print_results(results):
+    # print a table of the figures of every stage at every size
+    print("%-6s %-9s %9s %10s %8s %9s %9s %7s" %("items", "stage", "elapsed", "items/s", "MB/s",
+                                                  "p50", "p95", "errors"))
+    for result in results:
+        for stage in ("resolve", "download", "convert"):
+            figures = result[stage]
+            if figures is None:
+                continue
+            print("%-6s %-9s %9s %10s %8s %9s %9s %7s" %(result["items"], stage, figures["elapsed"],
+                                                          figures["items_per_second"],
+                                                          figures["mb_per_second"] or "-",
+                                                          figures["p50"], figures["p95"],
+                                                          figures["errors"]))
+
+def main(args=None):
+    # run the benchmark at every size and print the results
+    options = parse_arguments(args)
+    settings = Settings_Parser(options.settings)
+    if settings.get_format_type(options.chosen_format) not in ('a', 'av'):
+        sys.stderr.write("The benchmark supports audio and audio/video formats only\n")
+        return 2
+    if options.chosen_format != 'mp4' and not shutil.which('ffmpeg'):
+        sys.stderr.write("ffmpeg was not found, the conversions will fail\n")
+    server = build_server(options)
+    duration = time.strftime('%H:%M:%S', time.gmtime(options.duration))
+    streams.pafy.new = Fake_Pafy(server, duration, options.lookup_latency).new
+    bandwidth_limiter = Bandwidth_Limiter(parse_rate(options.max_rate or settings.get_max_rate()),
+                                          parse_rate(options.max_stream_rate or settings.get_max_stream_rate()),
+                                          settings.get_bandwidth_schedule())
+    benchmark = Benchmark(settings, server, options.chosen_format, workers=options.workers,
+                          convert_workers=options.convert_workers,
+                          resolve_workers=options.resolve_workers,
+                          bandwidth_limiter=bandwidth_limiter)
+    results = []
+    try:
+        for size in options.sizes.split(","):
+            results.append(benchmark.run(int(size)))
+    finally:
+        server.shutdown()
+        server.server_close()
+    print_results(results)
+    if options.json_path:
+        with open(options.json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
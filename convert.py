@@ -1,25 +1,257 @@
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, STDOUT
+import collections
+import subprocess
+import threading
 import os
 
+# number of lines of ffmpeg's log kept to report why a conversion failed
+LOG_TAIL_LINES = 20
+# keys ffmpeg writes to its -progress output, each block of them ends with the 'progress' key
+PROGRESS_KEYS = ('frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms', 'out_time',
+                 'dup_frames', 'drop_frames', 'speed', 'progress')
+
+def get_process_options(niceness):
+    # returns the Popen options that start a process with the niceness on Windows, which has
+    # priority classes instead. Elsewhere the priority is set once the process has started
+    if not niceness or os.name != 'nt':
+        return {}
+    if niceness < 0:
+        return {"creationflags": subprocess.ABOVE_NORMAL_PRIORITY_CLASS}
+    if niceness < 10:
+        return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {"creationflags": subprocess.IDLE_PRIORITY_CLASS}
+
+def set_process_priority(proc, niceness):
+    # give a started process the niceness, a positive niceness lowers the priority and a negative
+    # one raises it. This isn't done in preexec_fn, which can deadlock the child while other threads
+    # are running. Raising the priority needs privileges, without them ffmpeg keeps the default
+    if not niceness or not hasattr(os, 'setpriority'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, proc.pid, niceness)
+    except PermissionError:
+        print("Not permitted to set the niceness of ffmpeg to %s" %niceness)
+    except ProcessLookupError:
+        # ffmpeg has already exited
+        pass
+
+def wait_for_process(proc):
+    # wait for a process to exit, returns the CPU time in seconds it used or None where the
+    # platform can't tell
+    if not hasattr(os, 'wait4'):
+        proc.wait()
+        return None
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+def is_progress_line(key):
+    # checks if a 'key=value' line is part of ffmpeg's -progress output rather than its log
+    return key in PROGRESS_KEYS or (key.startswith('stream_') and key.endswith('_q'))
+
+def parse_out_time(progress):
+    # returns the number of seconds of output ffmpeg has written from a block of -progress output.
+    # out_time_ms holds microseconds as well in older versions of ffmpeg
+    for key in ('out_time_us', 'out_time_ms'):
+        try:
+            return int(progress[key]) / 1000000
+        except (KeyError, ValueError):
+            pass
+    try:
+        hours, minutes, seconds = progress['out_time'].split(':')
+        return int(hours)*3600 + int(minutes)*60 + float(seconds)
+    except (KeyError, ValueError):
+        return 0
+
+def parse_speed(progress):
+    # returns how many times faster than realtime ffmpeg is converting, or 0 if it isn't known yet
+    try:
+        return float(progress.get('speed', '').rstrip('x'))
+    except ValueError:
+        return 0
+
 class Convert():
     """ Use ffmpeg to convert a media file """
-    def __init__(self, dest_file_path, src_file_path, start_time, end_time):
-        command = self.build_command(dest_file_path, src_file_path, start_time, end_time)
-        print(command)
-        self.execute_command(command)
-        self.remove_original(src_file_path)
-
-    def build_command(self, file_path, sub_file_path, start_time, end_time):
-        # builds command for ffmpeg to convert stream
-        command = ('ffmpeg -i \"%s\" -ss %s -to %s -async 1 \"%s\"'
-                        %(sub_file_path, start_time, end_time, file_path))
-        return command
+    def __init__(self, dest_file_path, src_file_path, start_time, end_time, exact_trim=False,
+                 clip_offset=0, remux=False, threads=0, niceness=0, progress_callback=None):
+        self.dest_file_path = dest_file_path
+        # the codecs of the source fit the destination format and can be copied without re-encoding
+        self.remux = remux
+        # number of threads ffmpeg may use, 0 lets ffmpeg decide
+        self.threads = threads
+        self.niceness = niceness
+        # CPU time in seconds ffmpeg used, None where the platform can't tell
+        self.cpu_time = None
+        self.init_progress(start_time, end_time, progress_callback)
+        command = self.build_command(dest_file_path, src_file_path, start_time, end_time, exact_trim,
+                                     clip_offset)
+        print(subprocess.list2cmdline(command))
+        try:
+            self.execute_command(command)
+        finally:
+            # the downloaded file is of no use once ffmpeg has finished, failed or been stopped
+            self.remove_original(src_file_path)
+
+    def init_progress(self, start_time, end_time, progress_callback):
+        # set up reporting progress against the length of the trimmed clip. progress_callback is
+        # called like pafy's download callback with the clip's length and the seconds converted in
+        # place of bytes: (total, done, ratio, speed, eta). Raising an exception in it stops ffmpeg
+        self.progress_callback = progress_callback
+        self.total_seconds = self.get_trim_duration(start_time, end_time)
+        self.progress = {}
+        # only the end of ffmpeg's log is kept, it can be long for a long conversion
+        self.log_tail = collections.deque(maxlen=LOG_TAIL_LINES)
+
+    def build_command(self, file_path, sub_file_path, start_time, end_time, exact_trim, clip_offset=0):
+        # builds the arguments for ffmpeg to convert stream, ffmpeg is run without a shell so paths
+        # need no quoting. clip_offset is the time in seconds the source file starts at when only
+        # part of the stream was downloaded
+        start = '%.3f' %(self.time_to_seconds(start_time) - clip_offset)
+        end = '%.3f' %(self.time_to_seconds(end_time) - clip_offset)
+        duration = str(self.get_trim_duration(start_time, end_time))
+        if exact_trim:
+            # decode from the start of the file and re-encode, slow but cuts at the exact times
+            command = ['ffmpeg', '-i', sub_file_path, '-ss', start, '-to', end, '-async', '1']
+        elif self.is_stream_copy_possible(file_path, sub_file_path):
+            # seek on the input and copy the streams without re-encoding, the cut starts on the
+            # keyframe before the start time
+            command = ['ffmpeg', '-ss', start, '-i', sub_file_path, '-t', duration, '-c', 'copy',
+                       '-avoid_negative_ts', 'make_zero']
+        else:
+            # seek on the input so only the trimmed section is decoded and re-encoded
+            command = ['ffmpeg', '-ss', start, '-i', sub_file_path, '-t', duration, '-async', '1']
+        if self.threads:
+            command += ['-threads', str(self.threads)]
+        # write machine readable progress to stdout instead of the stats line to the log
+        command += ['-nostats', '-progress', 'pipe:1']
+        return command + [file_path]
+
+    def is_stream_copy_possible(self, file_path, sub_file_path):
+        # the codecs can be copied as they are when the file stays in the same container format or
+        # the destination format can hold the source's codecs
+        return self.remux or os.path.splitext(file_path)[1].lower() == os.path.splitext(sub_file_path)[1].lower()
+
+    def get_trim_duration(self, start_time, end_time):
+        # returns the number of seconds between the start and end time
+        return self.time_to_seconds(end_time) - self.time_to_seconds(start_time)
+
+    def time_to_seconds(self, time):
+        # converts a time in the format 'HH:MM:SS' to seconds
+        hours, minutes, seconds = str(time).split(':')
+        return int(hours)*3600 + int(minutes)*60 + int(seconds)
 
     def execute_command(self, cmd):
-        # execute command
-        proc = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-        proc.communicate()
+        # execute command reading its progress as it converts and record the CPU time ffmpeg used.
+        # The log is sent to the same pipe as the progress so a single thread reads both
+        proc = Popen(cmd, stdout=PIPE, stderr=STDOUT, **get_process_options(self.niceness))
+        set_process_priority(proc, self.niceness)
+        try:
+            self.read_output(proc.stdout)
+        except BaseException:
+            proc.kill()
+            wait_for_process(proc)
+            self.remove_output()
+            raise
+        finally:
+            proc.stdout.close()
+        self.cpu_time = wait_for_process(proc)
+        self.check_returncode(proc)
+
+    def read_output(self, output):
+        # read ffmpeg's output a line at a time until it exits, progress lines are collected into
+        # blocks and reported, the rest is kept in the log tail
+        for line in iter(output.readline, b''):
+            line = line.decode('utf-8', 'replace').strip()
+            key, separator, value = line.partition('=')
+            if separator and is_progress_line(key):
+                self.progress[key] = value
+                if key == 'progress':
+                    self.report_progress()
+            elif line:
+                self.log_tail.append(line)
+
+    def report_progress(self):
+        # pass the progress of the last block of -progress output to the callback
+        if not self.progress_callback:
+            return
+        done = parse_out_time(self.progress)
+        if self.progress.get('progress') == 'end':
+            done = self.total_seconds
+        done = max(0, min(done, self.total_seconds))
+        ratio = done / self.total_seconds if self.total_seconds > 0 else 0
+        speed = parse_speed(self.progress)
+        eta = (self.total_seconds - done) / speed if speed else None
+        self.progress_callback(self.total_seconds, done, ratio, speed, eta)
+
+    def check_returncode(self, proc):
+        # raise an error with the end of ffmpeg's log if the conversion failed
+        if proc.returncode != 0:
+            self.remove_output()
+            raise IOError("ffmpeg failed to convert the stream (exit code %s): %s"
+                          %(proc.returncode, self.get_log_tail()))
+
+    def get_log_tail(self):
+        # returns the last lines ffmpeg logged
+        return '\n'.join(self.log_tail)
 
     def remove_original(self, sub_file_path):
         # remove the old format
-        os.remove(sub_file_path)
\ No newline at end of file
+        os.remove(sub_file_path)
+
+    def remove_output(self):
+        # remove the converted file if ffmpeg created it
+        if os.path.isfile(self.dest_file_path):
+            os.remove(self.dest_file_path)
+
+class Pipe_Convert(Convert):
+    """ Use ffmpeg to convert a media file while it is being downloaded. The downloaded bytes are
+        written straight to ffmpeg's stdin so the unconverted file never touches the disk """
+    def __init__(self, dest_file_path, src_format, start_time, end_time, exact_trim=False,
+                 clip_offset=0, remux=False, threads=0, niceness=0, progress_callback=None):
+        self.dest_file_path = dest_file_path
+        self.src_format = src_format
+        self.remux = remux
+        self.threads = threads
+        self.cpu_time = None
+        self.init_progress(start_time, end_time, progress_callback)
+        command = self.build_command(dest_file_path, 'pipe:0', start_time, end_time, exact_trim,
+                                     clip_offset)
+        print(subprocess.list2cmdline(command))
+        self.proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=STDOUT, **get_process_options(niceness))
+        set_process_priority(self.proc, niceness)
+        # stdin is fed by the download, ffmpeg's output is read on another thread so it can't fill
+        # the pipe and stall the conversion
+        self.reader = threading.Thread(target=self.read_output, args=(self.proc.stdout,), daemon=True)
+        self.reader.start()
+
+    def is_stream_copy_possible(self, file_path, sub_file_path):
+        # the piped input has no file extension, compare against the format of the stream instead
+        return self.remux or os.path.splitext(file_path)[1].lower() == '.' + self.src_format.lower()
+
+    def write(self, chunk):
+        # pass downloaded bytes to ffmpeg, returns False once ffmpeg stops reading(i.e. the trimmed
+        # section has been converted)
+        try:
+            self.proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            return False
+        return True
+
+    def finish(self):
+        # signal the end of the input and wait for ffmpeg to finish converting
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.reader.join()
+        self.proc.stdout.close()
+        self.cpu_time = wait_for_process(self.proc)
+        self.check_returncode(self.proc)
+
+    def abort(self):
+        # stop ffmpeg and remove the partly converted file
+        self.proc.kill()
+        self.reader.join()
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.remove_output()
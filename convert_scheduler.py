@@ -0,0 +1,60 @@
+import threading
+import os
+
+class Convert_Scheduler():
+    """ Limits the number of ffmpeg processes running at once and decides how many threads each one
+        may use. Audio encoders barely use more than one thread so audio conversions get a single
+        thread, video conversions share the cores between the processes that can run at the same
+        time so overlapping conversions don't oversubscribe the CPU. Every process is started with
+        the same niceness """
+    def __init__(self, max_processes=0, niceness=0, cpu_count=None):
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        # 0 runs one process per CPU
+        self.max_processes = max_processes or self.cpu_count
+        self.niceness = niceness
+        self.condition = threading.Condition()
+        self.running = 0
+        # number of conversions waiting for a process slot
+        self.waiting = 0
+
+    def acquire(self, blocking=True):
+        # take a process slot, waiting for one to be released unless blocking is False. Returns
+        # whether a slot was taken
+        with self.condition:
+            if self.running >= self.max_processes and not blocking:
+                return False
+            self.waiting += 1
+            try:
+                while self.running >= self.max_processes:
+                    self.condition.wait()
+            finally:
+                self.waiting -= 1
+            self.running += 1
+        return True
+
+    def release(self):
+        # give back a process slot and wake a conversion waiting for one
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def get_threads(self, video):
+        # returns the number of threads ffmpeg should use for a conversion
+        if not video:
+            return 1
+        return max(1, self.cpu_count // self.max_processes)
+
+    def get_niceness(self):
+        # returns the niceness ffmpeg is started with, 0 leaves the priority unchanged
+        return self.niceness
+
+    def get_queue_depth(self):
+        # returns the number of conversions waiting for a process slot
+        return self.waiting
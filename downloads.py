@@ -0,0 +1,612 @@
+import collections
+import threading
+import functools
+import heapq
+import queue
+import time
+import os
+from convert import Convert, Pipe_Convert
+from http_download import Http_Download, Segmented_Download
+from partial_download import Partial_Download, Clip_Index_Error
+from metrics import Stream_Metrics
+from retry import Retry_Policy, PERMANENT, EXPIRED_URL
+from output_cache import get_output_key
+from convert_scheduler import Convert_Scheduler
+
+# statuses a stream ends with once it has been processed
+FINAL_STATUSES = ('Done', 'Error during download', 'Error during converting')
+
+class Download_Cancelled(Exception):
+    """ Raised from the download callback to abort a download that has been cancelled """
+    pass
+
+class Download_Queue():
+    """ Downloads and converts every stream in a download list. Streams are downloaded by a pool of
+        download workers and handed over to a separate pool of convert workers, so the next download
+        never waits for ffmpeg. A queue kept open waits for more streams to be added until it is
+        closed """
+    def __init__(self, download_list, workers=1, convert_workers=1, exact_trim=False,
+                 pipe_convert_formats=(), segments=1, partial_fetch_margin=None, bandwidth_limiter=None,
+                 retry_policy=None, output_cache=None, metrics_writer=None, convert_scheduler=None,
+                 keep_open=False, status_callback=None, progress_callback=None, finished_callback=None):
+        self.download_struc = self.structure_download_list(download_list)
+        self.workers = max(1, workers)
+        self.convert_workers = max(1, convert_workers)
+        self.exact_trim = exact_trim
+        self.pipe_convert_formats = pipe_convert_formats
+        self.segments = segments
+        # seconds fetched either side of a trimmed clip, None downloads trimmed streams in full
+        self.partial_fetch_margin = partial_fetch_margin
+        # limits the rate of every download, shared by all download workers, may be None
+        self.bandwidth_limiter = bandwidth_limiter
+        # decides whether and when a failed download is attempted again
+        self.retry_policy = retry_policy or Retry_Policy()
+        # provides streams that have been downloaded before and keeps the new ones, may be None
+        self.output_cache = output_cache
+        # records the metrics of every stream once it has finished, may be None
+        self.metrics_writer = metrics_writer
+        # the workers wait for streams to be added instead of stopping once the queue is empty
+        self.keep_open = keep_open
+        # positions of streams cancelled on their own while the rest of the queue carries on
+        self.cancelled_positions = set()
+        # number of workers holding each position, a discarded position is only forgotten once no
+        # worker holds it
+        self.held_positions = collections.Counter()
+        self.discarded_positions = set()
+        # position of the next stream added
+        self.next_position = len(self.download_struc)
+        self.status_callback = status_callback
+        self.progress_callback = progress_callback
+        self.finished_callback = finished_callback
+        self.error_list = []
+        self.force_stop_download = False
+        self.running_download_workers = 0
+        self.running_convert_workers = 0
+        self.finished = False
+        self.lock = threading.Lock()
+        # limits the number of ffmpeg processes and sets their threads and priority, shared by the
+        # convert workers and downloads that are converted while they download
+        self.convert_scheduler = convert_scheduler or Convert_Scheduler(self.convert_workers)
+        # positions in the download_struc waiting to be picked up by a download worker
+        self.pending = collections.deque(self.download_struc.keys())
+        # (due time, position) of failed downloads waiting to be attempted again, kept as a heap
+        self.retries = []
+        # number of downloads being attempted, a failed attempt may still schedule a retry
+        self.active_downloads = 0
+        # guards pending, retries and active_downloads and wakes workers waiting for a retry
+        self.download_condition = threading.Condition(self.lock)
+        # positions in the download_struc that have been downloaded and are waiting to be converted
+        self.convert_pending = queue.Queue()
+
+    def structure_download_list(self, download_list):
+        # generates and returns a dictionary that orders the streams by a number as tracking
+        # each streams download status and progress. The structure should look like the following:
+        #
+        # {
+        #     '1': {
+        #           'stream': <stream_obj>,
+        #           'status': 'Queued',
+        #           'progress': '',
+        #           'metrics': <stream_metrics_obj>,
+        #           'error': None
+        #          },
+        #     '2': {
+        #           'stream': <stream_obj>,
+        #           'status': 'Queued',
+        #           'progress': '',
+        #           'metrics': <stream_metrics_obj>,
+        #           'error': None
+        #          }
+        # }
+        temp = {}
+        for position, stream in enumerate(download_list):
+            temp[position] = {
+                                 'stream': stream,
+                                 'status': 'Queued',
+                                 'progress': '',
+                                 'metrics': Stream_Metrics(),
+                                 'error': None,
+                                 # look the stream up again before the next attempt
+                                 'refresh': False
+                                 }
+        return temp
+
+    def start(self):
+        # start a pool of download workers which pull streams from the queue until it is empty
+        # and a pool of convert workers which process the streams handed over by the download workers
+        download_workers = min(self.workers, len(self.download_struc))
+        convert_workers = min(self.convert_workers, self.count_conversions())
+        if self.keep_open:
+            # the streams that will be added are unknown so every worker is started
+            download_workers = self.workers
+            convert_workers = self.convert_workers
+        if not download_workers:
+            self.finish()
+            return
+        self.running_download_workers = download_workers
+        self.running_convert_workers = convert_workers
+        for _ in range(download_workers):
+            self.start_worker(self.download_worker)
+        for _ in range(convert_workers):
+            self.start_worker(self.convert_worker)
+
+    def start_worker(self, target):
+        # start a worker thread
+        worker = threading.Thread(target=target)
+        worker.daemon = True
+        worker.start()
+
+    def add(self, stream):
+        # add a stream to the end of a queue that is kept open, returns its position
+        with self.download_condition:
+            position = self.next_position
+            self.next_position += 1
+            self.download_struc[position] = self.structure_download_list([stream])[0]
+            self.pending.append(position)
+            self.download_condition.notify()
+        return position
+
+    def discard(self, position):
+        # forget a stream that has finished so a queue kept open doesn't grow with every stream it
+        # has processed. A stream still held by a worker, i.e. one that has just been cancelled, is
+        # forgotten once the worker lets go of it
+        with self.lock:
+            if self.held_positions[position]:
+                self.discarded_positions.add(position)
+            else:
+                self.forget(position)
+
+    def forget(self, position):
+        # remove every trace of a discarded stream, must be called holding the lock
+        self.download_struc.pop(position, None)
+        self.held_positions.pop(position, None)
+        self.cancelled_positions.discard(position)
+        self.discarded_positions.discard(position)
+        self.error_list = [error for error in self.error_list if error["position"] != position]
+
+    def hold(self, position):
+        # keep a position from being forgotten while a worker processes it
+        with self.lock:
+            self.held_positions[position] += 1
+
+    def release(self, position):
+        # let go of a position, a position discarded while it was held is forgotten now
+        with self.lock:
+            self.held_positions[position] -= 1
+            if self.held_positions[position] > 0:
+                return
+            del self.held_positions[position]
+            if position in self.discarded_positions:
+                self.forget(position)
+
+    def close(self):
+        # let the workers stop once every stream added so far has been processed
+        with self.download_condition:
+            self.keep_open = False
+            self.download_condition.notify_all()
+
+    def count_conversions(self):
+        # returns the number of streams that will need to be converted after downloading
+        count = 0
+        for position in self.download_struc.keys():
+            stream = self.download_struc[position]['stream']
+            if stream.is_convert_required() or stream.is_trimmed():
+                count += 1
+        return count
+
+    def download_worker(self):
+        # take the next queued stream until there are none left or the downloads are cancelled
+        while True:
+            position = self.get_next_position()
+            if position is None:
+                break
+            try:
+                self.download_stream(position)
+            finally:
+                self.release(position)
+                with self.download_condition:
+                    self.active_downloads -= 1
+                    self.download_condition.notify_all()
+        with self.lock:
+            self.running_download_workers -= 1
+            last_worker = self.running_download_workers == 0
+        if last_worker:
+            # nothing else will be queued for conversion, tell every convert worker to stop
+            # once it has emptied the conversion queue
+            for _ in range(self.running_convert_workers):
+                self.convert_pending.put(None)
+        self.worker_finished()
+
+    def get_next_position(self):
+        # returns the next stream to download. Queued streams are taken first, a worker only waits
+        # for a scheduled retry when nothing else is queued. Returns None once every stream has
+        # been downloaded or has failed and the queue isn't kept open, or the downloads are cancelled.
+        # Streams discarded while they waited are skipped
+        with self.download_condition:
+            while not self.force_stop_download:
+                if self.pending:
+                    position = self.pending.popleft()
+                elif self.retries and self.retries[0][0] <= time.time():
+                    position = heapq.heappop(self.retries)[1]
+                else:
+                    position = None
+                if position is not None:
+                    if position in self.download_struc:
+                        self.active_downloads += 1
+                        self.held_positions[position] += 1
+                        return position
+                    continue
+                if not self.retries and not self.active_downloads and not self.keep_open:
+                    return None
+                # wait for the next retry to be due or for an active download to finish
+                timeout = self.retries[0][0] - time.time() if self.retries else None
+                self.download_condition.wait(timeout)
+            return None
+
+    def schedule_retry(self, position, delay):
+        # attempt the stream at the given position again once the delay has passed
+        with self.download_condition:
+            heapq.heappush(self.retries, (time.time() + delay, position))
+            self.download_condition.notify_all()
+
+    def convert_worker(self):
+        # convert streams as they are handed over by the download workers
+        while True:
+            position = self.convert_pending.get()
+            if position is None:
+                break
+            try:
+                if not self.force_stop_download and position not in self.cancelled_positions:
+                    self.convert_stream(position)
+                else:
+                    self.remove_temp_file(position)
+            finally:
+                self.release(position)
+        with self.lock:
+            self.running_convert_workers -= 1
+        self.worker_finished()
+
+    def remove_temp_file(self, position):
+        # remove the downloaded file of a stream that was cancelled before it was converted
+        temp_file_path = self.download_struc[position]['stream'].get_temp_file_path()
+        if os.path.isfile(temp_file_path):
+            os.remove(temp_file_path)
+
+    def worker_finished(self):
+        # the last worker of either stage to exit finishes the queue
+        with self.lock:
+            finished = (self.running_download_workers == 0 and self.running_convert_workers == 0
+                        and not self.finished)
+            if finished:
+                self.finished = True
+        if finished:
+            self.finish()
+
+    def download_stream(self, position):
+        # Downloads the stream at the given position in the download_struc and if needed hands it
+        # over to be converted
+        stream = self.download_struc[position]['stream']
+        if position in self.cancelled_positions or self.fetch_cached_output(position):
+            return
+        # convert while downloading when ffmpeg can read the stream's format from a pipe and a
+        # conversion slot is free, otherwise the stream is downloaded to a temporary file
+        pipe_convert = self.is_pipe_convert_possible(stream) and self.convert_scheduler.acquire(blocking=False)
+        try:
+            self.download_stream_attempt(position, stream, pipe_convert)
+        finally:
+            if pipe_convert:
+                self.convert_scheduler.release()
+
+    def fetch_cached_output(self, position):
+        # provide the stream from the output cache when the same video, format and trim has been
+        # downloaded before. Returns False if the stream has to be downloaded
+        if not self.output_cache:
+            return False
+        stream = self.download_struc[position]['stream']
+        if not self.output_cache.fetch(self.get_output_key(stream), stream.get_file_path()):
+            return False
+        self.download_struc[position]['metrics'].from_cache = True
+        self.update_progress(position, '100')
+        self.update_status(position, 'Done')
+        return True
+
+    def store_output(self, position):
+        # keep a finished stream in the output cache, a failure to cache doesn't fail the stream
+        metrics = self.download_struc[position]['metrics']
+        if not self.output_cache or metrics.from_cache:
+            return
+        stream = self.download_struc[position]['stream']
+        try:
+            self.output_cache.store(self.get_output_key(stream), stream.get_file_path())
+        except (IOError, OSError) as error:
+            print(error)
+
+    def get_output_key(self, stream):
+        # returns the output cache key of a stream
+        return get_output_key(stream.get_video_id(), stream.get_chosen_format(),
+                              stream.get_start_time(), stream.get_end_time(),
+                              self.get_output_variant(stream))
+
+    def get_output_variant(self, stream):
+        # returns the settings that change the output file of a stream so they are part of its
+        # output cache key. A trimmed stream is cut on a keyframe or at the exact times and a video
+        # only stream's resolution depends on the video limits
+        variant = []
+        if stream.is_trimmed():
+            variant.append('exact' if self.exact_trim else 'fast')
+        if stream.get_video_quality():
+            variant.append(stream.get_video_quality())
+        return ','.join(variant)
+
+    def download_stream_attempt(self, position, stream, pipe_convert):
+        # make one attempt at downloading a stream, a failed attempt is either scheduled to be
+        # attempted again or recorded as an error
+        metrics = self.download_struc[position]['metrics']
+        if pipe_convert:
+            self.update_status(position, 'Downloading (converting)')
+        else:
+            self.update_status(position, 'Downloading')
+        # get a destination path for the download
+        if stream.is_convert_required() or stream.is_trimmed():
+            file_path = stream.get_temp_file_path()
+        else:
+            file_path = stream.get_file_path()
+        try:
+            # a stream from the metadata cache, or one whose signed URL has expired, is looked up again
+            stream.refresh_stream(force=self.download_struc[position]['refresh'])
+            self.download_struc[position]['refresh'] = False
+            metrics.start_attempt()
+            if pipe_convert:
+                self.pipe_convert_stream(position, stream)
+            elif not self.partial_download_stream(position, stream, file_path):
+                # a partial download from an earlier attempt or run is continued
+                Segmented_Download(stream.get_stream().url, file_path, stream.get_stream_id(),
+                                   total=stream.get_stream().get_filesize(),
+                                   callback=functools.partial(self.download_callback, position),
+                                   segments=self.segments, throttle=self.create_throttle()).run()
+        except Download_Cancelled:
+            return
+        except Exception as error:
+            self.download_failed(position, error)
+            return
+        metrics.finish_download()
+        if pipe_convert:
+            self.update_status(position, 'Done')
+        elif stream.is_convert_required() or stream.is_trimmed():
+            # let the next download start while the stream waits for a convert worker
+            metrics.queue_conversion(self.convert_pending.qsize() + self.convert_scheduler.get_queue_depth())
+            self.update_status(position, 'Queued for conversion')
+            # the convert worker holds the position from here on
+            self.hold(position)
+            self.convert_pending.put(position)
+        else:
+            self.update_status(position, 'Done')
+
+    def download_failed(self, position, error):
+        # schedule a failed download to be attempted again or record it as an error, depending on
+        # the kind of error and the number of attempts so far
+        metrics = self.download_struc[position]['metrics']
+        attempts = metrics.retries + 1
+        error_class = self.retry_policy.classify(error)
+        print(error, error_class, attempts)
+        if not self.retry_policy.should_retry(error_class, attempts, metrics.url_refreshes):
+            if error_class == PERMANENT:
+                error_message = "Download failed - " + str(error)
+            else:
+                error_message = "Exceeded maximum download attempts - " + str(error)
+            self.add_error(position, error_message)
+            self.update_status(position, 'Error during download')
+            return
+        metrics.retries = attempts
+        if error_class == EXPIRED_URL:
+            metrics.url_refreshes += 1
+            self.download_struc[position]['refresh'] = True
+        self.update_status(position, 'Waiting to retry')
+        self.schedule_retry(position, self.retry_policy.get_delay(error_class, attempts, error))
+
+    def convert_stream(self, position):
+        # convert the file if required(when a sub file format is used or the stream is trimmed)
+        stream = self.download_struc[position]['stream']
+        metrics = self.download_struc[position]['metrics']
+        try:
+            with self.convert_scheduler:
+                self.update_status(position, 'Converting')
+                metrics.start_conversion()
+                converter = Convert(stream.get_file_path(), stream.get_temp_file_path(),
+                                    stream.get_start_time(), stream.get_end_time(), exact_trim=self.exact_trim,
+                                    clip_offset=stream.get_clip_offset(), remux=stream.is_remux_possible(),
+                                    threads=self.convert_scheduler.get_threads(stream.is_video()),
+                                    niceness=self.convert_scheduler.get_niceness(),
+                                    progress_callback=functools.partial(self.convert_callback, position))
+                metrics.finish_conversion(converter.cpu_time)
+            self.update_status(position, 'Done')
+        except Download_Cancelled:
+            return
+        except Exception as error:
+            self.add_error(position, error)
+            self.update_status(position, 'Error during converting')
+
+    def is_pipe_convert_possible(self, stream):
+        # checks if the stream can be piped into ffmpeg while it downloads. Containers that ffmpeg
+        # needs to seek in(such as mp4) must be downloaded to a temporary file first
+        return stream.is_convert_required() and stream.get_stream().extension in self.pipe_convert_formats
+
+    def get_partial_download(self, position, stream):
+        # returns a download of only the part of a trimmed stream that covers the clip, or None if
+        # the stream isn't trimmed or its container has no index to find the clip with
+        stream.set_clip_offset(0)
+        if self.partial_fetch_margin is None or not stream.is_trimmed():
+            return None
+        download = Partial_Download(stream.get_stream().url, stream.get_start_seconds(),
+                                    stream.get_end_seconds(), margin=self.partial_fetch_margin,
+                                    total=stream.get_stream().get_filesize(),
+                                    callback=functools.partial(self.download_callback, position),
+                                    throttle=self.create_throttle())
+        try:
+            download.plan()
+        except Clip_Index_Error as error:
+            print(error)
+            return None
+        stream.set_clip_offset(download.clip_start)
+        return download
+
+    def partial_download_stream(self, position, stream, file_path):
+        # download only the part of a trimmed stream that covers the clip, returns False if the
+        # whole stream has to be downloaded instead
+        download = self.get_partial_download(position, stream)
+        if not download:
+            return False
+        with open(file_path, 'wb') as clip_file:
+            download.run(clip_file.write)
+        return True
+
+    def pipe_convert_stream(self, position, stream):
+        # download the stream straight into ffmpeg's stdin
+        download = self.get_partial_download(position, stream)
+        if not download:
+            download = Http_Download(stream.get_stream().url, total=stream.get_stream().get_filesize(),
+                                     callback=functools.partial(self.download_callback, position),
+                                     throttle=self.create_throttle())
+        converter = Pipe_Convert(stream.get_file_path(), stream.get_stream().extension,
+                                 stream.get_start_time(), stream.get_end_time(),
+                                 exact_trim=self.exact_trim, clip_offset=stream.get_clip_offset(),
+                                 remux=stream.is_remux_possible(),
+                                 threads=self.convert_scheduler.get_threads(stream.is_video()),
+                                 niceness=self.convert_scheduler.get_niceness())
+        try:
+            download.run(converter.write)
+        except BaseException:
+            converter.abort()
+            raise
+        # ffmpeg converts while the stream downloads, only the time it takes to finish is left
+        metrics = self.download_struc[position]['metrics']
+        metrics.start_conversion()
+        converter.finish()
+        metrics.finish_conversion(converter.cpu_time)
+
+    def create_throttle(self):
+        # returns a throttle for a single download, or None when the bandwidth isn't limited
+        if not self.bandwidth_limiter:
+            return None
+        return self.bandwidth_limiter.create_throttle()
+
+    def download_callback(self, position, total, recvd, ratio, rate, eta):
+        # Updates download progress for a stream, raising an exception aborts pafy's download loop
+        if self.force_stop_download or position in self.cancelled_positions:
+            raise Download_Cancelled()
+        self.download_struc[position]['metrics'].record_progress(recvd, rate)
+        progress = int(ratio*100)
+        self.update_progress(position, str(progress))
+
+    def convert_callback(self, position, total, done, ratio, speed, eta):
+        # Updates conversion progress for a stream, raising an exception stops ffmpeg
+        if self.force_stop_download or position in self.cancelled_positions:
+            raise Download_Cancelled()
+        progress = int(ratio*100)
+        self.update_progress(position, str(progress))
+
+    def update_status(self, position, status):
+        # updates the status of the stream at the given position and notifies the listener
+        if self.force_stop_download or position in self.cancelled_positions:
+            return
+        self.download_struc[position]['status'] = status
+        if status == 'Done':
+            self.store_output(position)
+        if status in FINAL_STATUSES:
+            self.write_metrics(position)
+        if self.status_callback:
+            self.status_callback(position, status)
+
+    def update_progress(self, position, progress):
+        # updates the progress of the stream at the given position and notifies the listener
+        if self.force_stop_download or position in self.cancelled_positions:
+            return
+        self.download_struc[position]['progress'] = progress
+        if self.progress_callback:
+            self.progress_callback(position, progress)
+
+    def add_error(self, position, error):
+        # record a stream that failed to download or convert
+        metrics = self.download_struc[position]['metrics']
+        metrics.error = str(error)
+        self.download_struc[position]['error'] = error
+        with self.lock:
+            self.error_list.append({
+                        "position": position,
+                        "name": self.download_struc[position]['stream'].get_title(),
+                        "error": error,
+                        "metrics": metrics})
+
+    def write_metrics(self, position):
+        # record the metrics of a stream that has finished downloading and converting
+        stream = self.download_struc[position]['stream']
+        metrics = self.download_struc[position]['metrics']
+        metrics.resolve_time = stream.get_resolve_time()
+        if not self.metrics_writer:
+            return
+        record = {"url": stream.get_url(),
+                  "title": stream.get_title(),
+                  "chosen_format": stream.get_chosen_format(),
+                  "status": self.download_struc[position]['status']}
+        record.update(metrics.as_dict())
+        self.metrics_writer.write(record)
+
+    def finish(self):
+        # all streams have been processed or the downloads were cancelled and every worker has stopped
+        if self.metrics_writer:
+            self.metrics_writer.finish()
+        if self.finished_callback:
+            self.finished_callback()
+
+    def cancel(self):
+        # stop all workers, streams currently being processed are aborted at the next
+        # progress update. Streams that have already finished keep their status. Returns the
+        # positions that were active when cancelled
+        # held under the lock so no stream is forgotten while the statuses are changed
+        with self.download_condition:
+            active = [position for position in self.download_struc.keys()
+                      if self.download_struc[position]['status'] in ('Downloading', 'Downloading (converting)',
+                                                                     'Converting')]
+            self.force_stop_download = True
+            for position in self.download_struc.keys():
+                if self.download_struc[position]['status'] in FINAL_STATUSES:
+                    continue
+                if position in active:
+                    self.download_struc[position]['status'] = 'Cancelling ...'
+                else:
+                    self.download_struc[position]['status'] = 'Cancelled'
+                self.download_struc[position]['progress'] = ''
+            # wake the workers waiting for a retry so they can stop
+            self.download_condition.notify_all()
+        return active
+
+    def cancel_stream(self, position):
+        # stop a single stream, the other streams carry on. A stream being downloaded or converted
+        # is aborted at its next progress update, stopping ffmpeg and removing its files
+        if position in self.cancelled_positions:
+            return
+        self.cancelled_positions.add(position)
+        self.download_struc[position]['status'] = 'Cancelled'
+        self.download_struc[position]['progress'] = ''
+        if self.status_callback:
+            self.status_callback(position, 'Cancelled')
+
+    def is_cancelled(self):
+        # returns whether the downloads have been cancelled
+        return self.force_stop_download
+
+    def is_running(self):
+        # returns a boolean for if whether any streams are currently being downloaded or converted
+        return self.running_download_workers > 0 or self.running_convert_workers > 0
+
+    def get_download_struc(self):
+        # returns the download tracking structure
+        return self.download_struc
+
+    def get_errors(self):
+        # returns a list of streams that failed to download or convert
+        return self.error_list
+
+    def get_error(self, position):
+        # returns the error of the stream at the given position, or None if it hasn't failed
+        return self.download_struc[position]['error']
@@ -0,0 +1,30 @@
+import collections
+import threading
+import itertools
+
+class Event_Bus():
+    """ Passes events from worker threads to the Tk thread. Workers post events from any thread and
+        the Tk thread drains them on a timer. Events posted with a key are coalesced, only the latest
+        value for each event and key is kept until the next drain, so the cost of updating the
+        window stays flat however often the workers post """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        # gives events without a key a unique key so they are never coalesced
+        self.counter = itertools.count()
+
+    def post(self, event, key=None, value=None):
+        # post an event, replacing any undrained value for the same event and key
+        with self.lock:
+            if key is None:
+                self.pending[(event, ('unique', next(self.counter)))] = (key, value)
+                return
+            self.pending.pop((event, key), None)
+            self.pending[(event, key)] = (key, value)
+
+    def drain(self):
+        # returns every pending event as (event, key, value) in the order they were last posted
+        with self.lock:
+            pending = self.pending
+            self.pending = collections.OrderedDict()
+        return [(event, key, value) for (event, _), (key, value) in pending.items()]
@@ -0,0 +1,53 @@
+import threading
+import os
+
+class File_Names():
+    """ Reserves unique file names for every stream in a batch. Each directory is scanned once and
+        names are reserved in memory, so two streams with the same title get different paths even
+        before either file exists and no file is checked for more than once """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories = {}
+
+    def get_names(self, directory):
+        # returns the set of names taken in the directory, scanning it the first time it is used.
+        # Must be called holding the lock
+        key = os.path.normcase(os.path.abspath(directory))
+        names = self.directories.get(key)
+        if names is None:
+            try:
+                names = set(os.path.normcase(name) for name in os.listdir(directory))
+            except OSError:
+                # the directory doesn't exist yet
+                names = set()
+            self.directories[key] = names
+        return names
+
+    def reserve(self, base_path, extension, temp_extension=None):
+        # reserve a path for base_path with the extension, ' - Copy' is added until the name is
+        # unique. When a temp_extension is given a temporary path is reserved alongside it with
+        # '_TEMP' added until it is unique. Returns the path and the temporary path or None
+        directory, name = os.path.split(base_path)
+        with self.lock:
+            names = self.get_names(directory)
+            while os.path.normcase(name + '.' + extension) in names:
+                name += " - Copy"
+            names.add(os.path.normcase(name + '.' + extension))
+            temp_path = None
+            if temp_extension:
+                temp_name = name + '_TEMP'
+                while os.path.normcase(temp_name + '.' + temp_extension) in names:
+                    temp_name += '_TEMP'
+                names.add(os.path.normcase(temp_name + '.' + temp_extension))
+                temp_path = os.path.join(directory, temp_name + '.' + temp_extension)
+        return os.path.join(directory, name + '.' + extension), temp_path
+
+    def release(self, *paths):
+        # give up reserved paths so other streams can use them, a path that has been written to
+        # stays taken
+        with self.lock:
+            for path in paths:
+                if path is None or os.path.exists(path):
+                    continue
+                directory, name = os.path.split(path)
+                self.get_names(directory).discard(os.path.normcase(name))
@@ -0,0 +1,293 @@
+import urllib.request
+import threading
+import json
+import time
+import os
+
+class Range_Not_Supported(IOError):
+    """ Raised when the server answers a range request with the whole stream """
+
+class Http_Download():
+    """ Downloads a URL in chunks and hands every chunk to a writer. Progress is reported with the
+        same arguments as pafy's download callback: total, received, ratio, rate(kB/s) and eta(s).
+        throttle is called with the size of every chunk received and may sleep to limit the rate """
+    def __init__(self, url, total=0, callback=None, chunk_size=16384, timeout=30, throttle=None):
+        self.url = url
+        self.total = total
+        self.callback = callback
+        self.throttle = throttle
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.received = 0
+        # bytes that were already downloaded before this download started
+        self.offset = 0
+
+    def open(self, headers=None):
+        # open a connection to the URL
+        request = urllib.request.Request(self.url, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def run(self, write):
+        # download the URL passing every chunk to write, the download stops early if write returns False
+        response = self.open()
+        try:
+            if not self.total:
+                self.total = int(response.headers.get("Content-Length") or 0)
+            self.read_response(response, write)
+        finally:
+            response.close()
+
+    def read_response(self, response, write):
+        # read the response body in chunks until it is exhausted or the writer stops accepting data
+        started = time.time()
+        while True:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                break
+            self.received += len(chunk)
+            if self.throttle:
+                self.throttle(len(chunk))
+            self.report_progress(started)
+            if write(chunk) is False:
+                break
+
+    def report_progress(self, started):
+        # call the progress callback with the pafy style statistics
+        if not self.callback:
+            return
+        elapsed = max(time.time() - started, 0.001)
+        rate = ((self.received - self.offset) / 1024.0) / elapsed
+        if self.total:
+            ratio = float(self.received) / self.total
+            eta = (self.total - self.received) / 1024.0 / rate if rate else 0
+        else:
+            ratio = 0
+            eta = 0
+        self.callback(self.total, self.received, ratio, rate, eta)
+
+class Resumable_Download(Http_Download):
+    """ Downloads a URL to a file. The partly downloaded file is kept next to the destination with a
+        small state file, so a retry or a later run continues where the download stopped using an
+        HTTP Range request. The state file records which stream the partial file belongs to """
+    def __init__(self, url, file_path, stream_id, total=0, callback=None, chunk_size=16384, timeout=30,
+                 throttle=None):
+        super(Resumable_Download, self).__init__(url, total, callback, chunk_size, timeout, throttle)
+        self.file_path = file_path
+        self.part_path = file_path + '.part'
+        self.state_path = file_path + '.part.json'
+        self.stream_id = stream_id
+
+    def run(self):
+        # download the URL to the file, resuming a previous partial download if there is one
+        self.offset = self.get_resume_offset()
+        if self.total and self.offset >= self.total:
+            # the previous attempt received everything but failed before finishing up
+            self.complete()
+            return
+        headers = {}
+        if self.offset:
+            headers["Range"] = "bytes=%s-" %self.offset
+        response = self.open(headers)
+        try:
+            if self.offset and response.status != 206:
+                # the server ignored the range, start again from the beginning
+                self.offset = 0
+            if not self.total:
+                self.total = self.offset + int(response.headers.get("Content-Length") or 0)
+            self.save_state()
+            self.received = self.offset
+            if self.offset:
+                mode = 'ab'
+            else:
+                mode = 'wb'
+            with open(self.part_path, mode) as part_file:
+                self.read_response(response, part_file.write)
+        finally:
+            response.close()
+        if self.total and self.received < self.total:
+            raise IOError("Connection closed after %s of %s bytes" %(self.received, self.total))
+        self.complete()
+
+    def get_resume_offset(self):
+        # returns the number of bytes already downloaded for this stream, a partial file that
+        # belongs to a different stream is discarded
+        try:
+            with open(self.state_path, 'r') as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError):
+            return 0
+        if state.get("stream_id") != self.stream_id or not os.path.isfile(self.part_path):
+            return 0
+        if self.total and state.get("total") and state["total"] != self.total:
+            return 0
+        if not self.total:
+            self.total = state.get("total") or 0
+        if state.get("segments"):
+            return self.get_segmented_resume_offset(state["segments"])
+        return os.path.getsize(self.part_path)
+
+    def get_segmented_resume_offset(self, segments):
+        # returns the number of bytes a segmented download received contiguously from the start of
+        # the stream. The partial file of a segmented download is preallocated at full size so its
+        # size says nothing about what was received, it is cut back to the first segment's data
+        if not segments or segments[0].get("start") != 0:
+            return 0
+        offset = min(segments[0].get("done", 0), os.path.getsize(self.part_path))
+        with open(self.part_path, 'r+b') as part_file:
+            part_file.truncate(offset)
+        return offset
+
+    def save_state(self):
+        # record which stream the partial file belongs to
+        with open(self.state_path, 'w') as state_file:
+            json.dump({"stream_id": self.stream_id,
+                       "url": self.url,
+                       "total": self.total}, state_file)
+
+    def complete(self):
+        # move the finished download to its destination and remove the state file
+        os.replace(self.part_path, self.file_path)
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+class Segmented_Download(Resumable_Download):
+    """ Downloads a URL to a file over several connections at once. The known size of the stream is
+        split into byte ranges which are fetched in parallel and written to their offset in a
+        preallocated file. The progress of every segment is kept in the state file so an
+        interrupted download resumes each segment where it stopped """
+    # streams smaller than this per segment are downloaded over a single connection
+    min_segment_size = 1048576
+    # save the state file after every segment has received roughly this many bytes
+    save_interval = 1048576
+
+    def __init__(self, url, file_path, stream_id, total=0, callback=None, segments=4,
+                 chunk_size=16384, timeout=30, throttle=None):
+        super(Segmented_Download, self).__init__(url, file_path, stream_id, total, callback,
+                                                 chunk_size, timeout, throttle)
+        self.segment_count = segments
+        self.segments = []
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def run(self):
+        # download the URL in segments, streams of an unknown or small size use a single connection
+        if self.segment_count < 2 or self.total < self.min_segment_size * 2:
+            super(Segmented_Download, self).run()
+            return
+        self.segments = self.load_segments() or self.split_segments()
+        self.offset = sum(segment["done"] for segment in self.segments)
+        self.received = self.offset
+        self.preallocate()
+        self.save_state()
+        self.started = time.time()
+        threads = []
+        for segment in self.segments:
+            if segment["start"] + segment["done"] <= segment["end"]:
+                thread = threading.Thread(target=self.download_segment, args=(segment,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.save_state()
+        if any(isinstance(error, Range_Not_Supported) for error in self.errors):
+            self.run_single_connection()
+            return
+        if self.errors:
+            raise self.errors[0]
+        self.complete()
+
+    def run_single_connection(self):
+        # start the download again over a single connection when the server ignores range requests
+        for path in (self.part_path, self.state_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.segments = []
+        self.errors = []
+        self.offset = 0
+        self.received = 0
+        super(Segmented_Download, self).run()
+
+    def split_segments(self):
+        # divide the stream into segments of equal size, the last segment takes the remainder
+        count = min(self.segment_count, self.total // self.min_segment_size)
+        size = self.total // count
+        segments = []
+        for number in range(count):
+            start = number * size
+            end = self.total - 1 if number == count - 1 else start + size - 1
+            segments.append({"start": start, "end": end, "done": 0})
+        return segments
+
+    def load_segments(self):
+        # returns the segments recorded by an interrupted download of the same stream, or None
+        try:
+            with open(self.state_path, 'r') as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError):
+            return None
+        if (state.get("stream_id") != self.stream_id or state.get("total") != self.total
+                or not state.get("segments") or not os.path.isfile(self.part_path)):
+            return None
+        return state["segments"]
+
+    def preallocate(self):
+        # create the partial file at its full size so every segment can write to its own offset
+        mode = 'r+b' if os.path.isfile(self.part_path) else 'wb'
+        with open(self.part_path, mode) as part_file:
+            part_file.truncate(self.total)
+
+    def save_state(self):
+        # record which stream the partial file belongs to and how far each segment has got
+        with self.lock:
+            state = {"stream_id": self.stream_id,
+                     "url": self.url,
+                     "total": self.total}
+            # a download over a single connection records no segments and resumes from the file size
+            if self.segments:
+                state["segments"] = [dict(segment) for segment in self.segments]
+            # written while holding the lock so segments don't write the file at the same time
+            with open(self.state_path, 'w') as state_file:
+                json.dump(state, state_file)
+
+    def download_segment(self, segment):
+        # fetch the remaining bytes of one segment and write them to its offset in the file
+        try:
+            start = segment["start"] + segment["done"]
+            response = self.open({"Range": "bytes=%s-%s" %(start, segment["end"])})
+            try:
+                if response.status != 206:
+                    raise Range_Not_Supported("The server does not support range requests")
+                with open(self.part_path, 'r+b') as part_file:
+                    part_file.seek(start)
+                    self.read_segment(response, part_file, segment)
+            finally:
+                response.close()
+            if segment["start"] + segment["done"] <= segment["end"]:
+                raise IOError("Connection closed after %s of %s bytes"
+                              %(segment["done"], segment["end"] - segment["start"] + 1))
+        except BaseException as error:
+            with self.lock:
+                self.errors.append(error)
+
+    def read_segment(self, response, part_file, segment):
+        # read a segment's response in chunks until it is exhausted or another segment has failed
+        unsaved = 0
+        while not self.errors:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                break
+            if self.throttle:
+                self.throttle(len(chunk))
+            part_file.write(chunk)
+            unsaved += len(chunk)
+            with self.lock:
+                segment["done"] += len(chunk)
+                self.received += len(chunk)
+            if unsaved >= self.save_interval:
+                # the data must reach the file before the state file claims it has been received
+                part_file.flush()
+                self.save_state()
+                unsaved = 0
+            self.report_progress(self.started)
+        part_file.flush()
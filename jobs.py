@@ -0,0 +1,131 @@
+import collections
+import threading
+import json
+import time
+import os
+
+# statuses a job never leaves, every other job is queued again when the service restarts. A
+# playlist job is expanded into a job for each of its videos
+FINISHED_STATUSES = ('Done', 'Error during lookup', 'Error during download', 'Error during converting',
+                     'Cancelled', 'Expanded')
+
+def replay_job_record(jobs, record):
+    # apply a single journal record to an ordered dictionary of jobs, unknown records are ignored
+    if record.get("op") == "add":
+        jobs[record["job"]["id"]] = record["job"]
+    elif record.get("op") == "update" and record.get("id") in jobs:
+        jobs[record["id"]].update(record["fields"])
+
+class Job_Store():
+    """ Keeps the jobs submitted to the download service as an append-only journal of add and update
+        records, one JSON object per line, so submitting a job only appends a line to the file. The
+        journal is compacted to one add record per job once it holds too many stale records, only
+        the most recently finished jobs are kept """
+    def __init__(self, file_path, compact_threshold=1000, max_finished_jobs=1000):
+        self.file_path = file_path
+        self.compact_threshold = compact_threshold
+        # number of finished jobs kept when the journal is compacted, 0 keeps every job
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = collections.OrderedDict()
+        self.record_count = 0
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        # replay the journal, a missing journal leaves the store empty and a torn last line is ignored
+        try:
+            with open(self.file_path, 'r') as jobs_file:
+                for line in jobs_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("op") == "next_id":
+                        # written by compaction so the IDs of dropped jobs aren't used again
+                        self.next_id = max(self.next_id, record["next_id"])
+                    replay_job_record(self.jobs, record)
+                    self.record_count += 1
+        except IOError:
+            return
+        if self.jobs:
+            self.next_id = max(self.next_id, max(self.jobs.keys()) + 1)
+
+    def add(self, meta):
+        # add a queued job for the stream meta and returns it
+        with self.lock:
+            job = {"id": self.next_id,
+                   "url": meta["url"],
+                   "chosen_format": meta["chosen_format"],
+                   "start_time": str(meta.get("start_time") or ""),
+                   "end_time": str(meta.get("end_time") or ""),
+                   "title": None,
+                   "file_path": None,
+                   "status": 'Queued',
+                   "error": None,
+                   "submitted": time.time(),
+                   "finished": None}
+            self.next_id += 1
+            self.append_record({"op": "add", "job": job})
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        # change fields of a job, the time a job finishes is recorded with its final status
+        if fields.get("status") in FINISHED_STATUSES:
+            fields["finished"] = time.time()
+        with self.lock:
+            self.append_record({"op": "update", "id": job_id, "fields": fields})
+
+    def append_record(self, record):
+        # apply the record and write it to the end of the journal, must be called holding the lock
+        replay_job_record(self.jobs, record)
+        self.record_count += 1
+        if self.is_compaction_due():
+            self.compact()
+            return
+        directory = os.path.dirname(self.file_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.file_path, 'a') as jobs_file:
+            jobs_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def is_compaction_due(self):
+        # checks if the journal holds more stale records than the compaction threshold
+        return self.record_count - len(self.jobs) > self.compact_threshold
+
+    def compact(self):
+        # rewrite the journal as one add record per job, dropping the jobs that finished longest
+        # ago. The file is replaced atomically
+        self.drop_finished_jobs()
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as jobs_file:
+            jobs_file.write(json.dumps({"op": "next_id", "next_id": self.next_id}) + '\n')
+            for job in self.jobs.values():
+                jobs_file.write(json.dumps({"op": "add", "job": job}, sort_keys=True) + '\n')
+        os.replace(temp_path, self.file_path)
+        self.record_count = len(self.jobs) + 1
+
+    def drop_finished_jobs(self):
+        # forget the finished jobs beyond the most recently finished max_finished_jobs, must be
+        # called holding the lock
+        if not self.max_finished_jobs:
+            return
+        finished = [job for job in self.jobs.values() if job["status"] in FINISHED_STATUSES]
+        finished.sort(key=lambda job: job.get("finished") or job["submitted"])
+        for job in finished[:-self.max_finished_jobs]:
+            del self.jobs[job["id"]]
+
+    def get_job(self, job_id):
+        # returns a copy of the job with the id, or None
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_jobs(self):
+        # returns a copy of every job in the order they were submitted
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def get_unfinished_jobs(self):
+        # returns a copy of every job that was still queued or being processed
+        return [job for job in self.get_jobs() if job["status"] not in FINISHED_STATUSES]
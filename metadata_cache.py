@@ -0,0 +1,159 @@
+import collections
+import threading
+import json
+import time
+import re
+import os
+
+# matches the 11 character video ID in the URL formats youtube uses, or a bare video ID
+VIDEO_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|embed/|shorts/|/v/)([\w-]{11})|^([\w-]{11})$')
+
+def extract_video_id(url):
+    # returns the video ID from a youtube URL or None if one can't be found
+    match = VIDEO_ID_PATTERN.search(url.strip())
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+class Cached_Stream():
+    """ Stands in for a pafy stream while the stream meta comes from the metadata cache. It has
+        no download URL, the real stream must be fetched with pafy before downloading """
+    def __init__(self, title, meta):
+        self.title = title
+        self.extension = meta["extension"]
+        self.mediatype = meta["mediatype"]
+        self.bitrate = meta["bitrate"]
+        self.rawbitrate = meta["rawbitrate"]
+        self.resolution = meta["resolution"]
+        self.size = meta["size"]
+
+    def get_filesize(self):
+        # returns the size of the stream in bytes, 0 if it wasn't known when cached
+        return self.size or 0
+
+class Cached_Video():
+    """ Stands in for a pafy object using the metadata cache. The stream selection mirrors pafy's
+        getbest and getbestaudio so a warm cache picks the same stream as the network would """
+    def __init__(self, video_id, meta):
+        self.videoid = video_id
+        self.title = meta["title"]
+        self.duration = meta["duration"]
+        self.published = meta["published"]
+        self.allstreams = [Cached_Stream(self.title, stream_meta) for stream_meta in meta["streams"]]
+        self.streams = [s for s in self.allstreams if s.mediatype == "normal"]
+        self.audiostreams = [s for s in self.allstreams if s.mediatype == "audio"]
+        self.videostreams = [s for s in self.allstreams if s.mediatype == "video"]
+
+    def getbest(self, preftype="any"):
+        # return the best audio and video stream, preferring the given extension
+        if not self.streams:
+            return None
+        def sort_key(stream):
+            return ("3D" not in stream.resolution,
+                    preftype == stream.extension,
+                    int(stream.resolution.split("x")[0]))
+        best = max(self.streams, key=sort_key)
+        if preftype != "any" and best.extension != preftype:
+            return None
+        return best
+
+    def getbestaudio(self, preftype="any"):
+        # return the best audio only stream, preferring the given extension
+        if not self.audiostreams:
+            return None
+        def sort_key(stream):
+            return (preftype == stream.extension, int(stream.rawbitrate or 0))
+        best = max(self.audiostreams, key=sort_key)
+        if preftype != "any" and best.extension != preftype:
+            return None
+        return best
+
+class Metadata_Cache():
+    """ Persistent cache of video meta keyed by video ID so URLs can be resolved without the network.
+        Entries expire after a time to live and the least recently used entries are evicted once the
+        cache holds more than the maximum number of entries """
+    def __init__(self, file_path, ttl, max_entries, save_interval=5):
+        self.file_path = file_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.last_saved = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.load()
+
+    def load(self):
+        # read the cache file, a missing or corrupt file leaves the cache empty
+        try:
+            with open(self.file_path, 'r') as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            return
+        for video_id, meta in entries.items():
+            if not self.is_expired(meta):
+                self.entries[video_id] = meta
+
+    def save(self):
+        # write the cache to disk if it has changed, the file is replaced atomically
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = dict(self.entries)
+            self.dirty = False
+            self.last_saved = time.time()
+        directory = os.path.dirname(self.file_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(temp_path, self.file_path)
+
+    def is_expired(self, meta):
+        # checks if a cache entry is older than the time to live
+        return time.time() - meta["stored"] > self.ttl
+
+    def get(self, url):
+        # returns a Cached_Video for the URL or None if it isn't cached
+        video_id = extract_video_id(url)
+        if not video_id:
+            return None
+        with self.lock:
+            meta = self.entries.get(video_id)
+            if meta is None:
+                return None
+            if self.is_expired(meta):
+                del self.entries[video_id]
+                self.dirty = True
+                return None
+            # mark as the most recently used entry
+            self.entries.move_to_end(video_id)
+        return Cached_Video(video_id, meta)
+
+    def store(self, vid):
+        # add the meta of a pafy object to the cache
+        meta = {"stored": time.time(),
+                "title": vid.title,
+                "duration": vid.duration,
+                "published": vid.published,
+                "streams": [self.stream_meta(stream) for stream in vid.allstreams]}
+        with self.lock:
+            self.entries[vid.videoid] = meta
+            self.entries.move_to_end(vid.videoid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+            save_due = time.time() - self.last_saved > self.save_interval
+        if save_due:
+            self.save()
+
+    def stream_meta(self, stream):
+        # returns the meta of a pafy stream that is needed to select a stream without the network.
+        # pafy only knows the size without a request when the backend supplied it
+        return {"extension": stream.extension,
+                "mediatype": stream.mediatype,
+                "bitrate": stream.bitrate,
+                "rawbitrate": getattr(stream, "rawbitrate", None),
+                "resolution": stream.resolution,
+                "size": getattr(stream, "_fsize", None)}
@@ -0,0 +1,177 @@
+import threading
+import json
+import time
+import os
+
+def get_metrics_file_path(session_file_path):
+    # returns the path of the metrics file kept next to a session file
+    return os.path.splitext(session_file_path)[0] + '.metrics.jsonl'
+
+class Stream_Metrics():
+    """ Timings and counters of a single stream as it moves through the download pipeline. Times
+        are in seconds, the rate is the average in kB/s as reported by the download callback """
+    def __init__(self):
+        self.resolve_time = None
+        self.time_to_first_byte = None
+        self.download_duration = None
+        self.average_rate = None
+        self.bytes = 0
+        self.convert_duration = None
+        self.convert_wait = None # time spent queued for conversion
+        self.convert_queue_depth = None # conversions queued ahead when the stream was queued
+        self.convert_cpu_time = None # CPU time ffmpeg used, None where the platform can't tell
+        self.retries = 0
+        self.url_refreshes = 0
+        self.from_cache = False
+        self.error = None
+        self.download_started = None
+        self.attempt_started = None
+        self.convert_queued = None
+        self.convert_started = None
+
+    def start_attempt(self):
+        # mark the start of a download attempt, the time to first byte is measured from here and the
+        # download duration from the first attempt
+        self.attempt_started = time.time()
+        self.time_to_first_byte = None
+        if self.download_started is None:
+            self.download_started = self.attempt_started
+
+    def finish_download(self):
+        # record the time taken to download the stream, including any failed attempts
+        self.download_duration = time.time() - self.download_started
+
+    def queue_conversion(self, queue_depth):
+        # mark the stream as queued for conversion behind queue_depth other conversions
+        self.convert_queued = time.time()
+        self.convert_queue_depth = queue_depth
+
+    def start_conversion(self):
+        # mark the start of the conversion, the time queued is measured up to here
+        self.convert_started = time.time()
+        if self.convert_queued is not None:
+            self.convert_wait = self.convert_started - self.convert_queued
+
+    def finish_conversion(self, cpu_time=None):
+        # record the time taken to convert the stream and the CPU time ffmpeg used
+        self.convert_duration = time.time() - self.convert_started
+        self.convert_cpu_time = cpu_time
+
+    def record_progress(self, received, rate):
+        # record the progress passed to the download callback
+        if self.time_to_first_byte is None and self.attempt_started is not None:
+            self.time_to_first_byte = time.time() - self.attempt_started
+        self.bytes = received
+        self.average_rate = rate
+
+    def get_summary(self):
+        # returns the metrics as a short line of text
+        parts = []
+        for label, value, unit in (("resolve", self.resolve_time, "s"),
+                                   ("ttfb", self.time_to_first_byte, "s"),
+                                   ("download", self.download_duration, "s"),
+                                   ("rate", self.average_rate, "kB/s"),
+                                   ("queued", self.convert_wait, "s"),
+                                   ("convert", self.convert_duration, "s"),
+                                   ("cpu", self.convert_cpu_time, "s")):
+            if value is not None:
+                parts.append("%s %.2f%s" %(label, value, unit))
+        parts.append("%s bytes" %self.bytes)
+        parts.append("%s retries" %self.retries)
+        return ", ".join(parts)
+
+    def as_dict(self):
+        # returns the metrics as a dictionary which can be written as JSON
+        return {"resolve_time": self.resolve_time,
+                "time_to_first_byte": self.time_to_first_byte,
+                "download_duration": self.download_duration,
+                "average_rate": self.average_rate,
+                "bytes": self.bytes,
+                "convert_duration": self.convert_duration,
+                "convert_wait": self.convert_wait,
+                "convert_queue_depth": self.convert_queue_depth,
+                "convert_cpu_time": self.convert_cpu_time,
+                "retries": self.retries,
+                "url_refreshes": self.url_refreshes,
+                "from_cache": self.from_cache,
+                "error": self.error}
+
+class Metrics_Writer():
+    """ Appends the metrics of every finished stream to a JSON-lines file. Running totals are kept
+        instead of the records, so a writer used by a service for as long as it runs doesn't grow.
+        The totals can also be written in the Prometheus text format for a node exporter's textfile
+        collector, the file is rewritten as every stream finishes """
+    # the stages timed for every stream with the key of their duration in a record
+    stages = (("resolve", "resolve_time"),
+              ("first_byte", "time_to_first_byte"),
+              ("download", "download_duration"),
+              ("convert_wait", "convert_wait"),
+              ("convert", "convert_duration"),
+              ("convert_cpu", "convert_cpu_time"))
+
+    def __init__(self, file_path, prometheus_file_path=None):
+        self.file_path = file_path
+        self.prometheus_file_path = prometheus_file_path
+        self.statuses = {}
+        self.bytes = 0
+        self.retries = 0
+        self.stage_sums = dict((stage, 0.0) for stage, _ in self.stages)
+        self.stage_counts = dict((stage, 0) for stage, _ in self.stages)
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        # append the record of a finished stream to the metrics file and add it to the totals
+        with self.lock:
+            self.add_to_totals(record)
+            with open(self.file_path, 'a') as metrics_file:
+                metrics_file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.write_prometheus()
+
+    def add_to_totals(self, record):
+        # count a record in the running totals, must be called holding the lock
+        self.statuses[record["status"]] = self.statuses.get(record["status"], 0) + 1
+        self.bytes += record["bytes"]
+        self.retries += record["retries"]
+        for stage, key in self.stages:
+            if record[key] is not None:
+                self.stage_sums[stage] += record[key]
+                self.stage_counts[stage] += 1
+
+    def finish(self):
+        # write the totals of every stream recorded to the Prometheus file
+        self.write_prometheus()
+
+    def write_prometheus(self):
+        # write the totals to the Prometheus file, if there is one
+        if not self.prometheus_file_path:
+            return
+        with self.lock:
+            lines = self.build_prometheus_lines()
+            # the file is replaced atomically so the collector never reads a partly written file
+            temp_path = self.prometheus_file_path + '.tmp'
+            with open(temp_path, 'w') as prometheus_file:
+                prometheus_file.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.prometheus_file_path)
+
+    def build_prometheus_lines(self):
+        # returns the lines of the Prometheus text format for the totals, must be called holding the lock
+        lines = ["# HELP youtube_downloader_streams Streams processed in the last batch by final status.",
+                 "# TYPE youtube_downloader_streams gauge"]
+        for status in sorted(self.statuses):
+            lines.append('youtube_downloader_streams{status="%s"} %s' %(status.replace('"', '\\"'),
+                                                                        self.statuses[status]))
+        lines += ["# HELP youtube_downloader_bytes Bytes downloaded in the last batch.",
+                  "# TYPE youtube_downloader_bytes gauge",
+                  "youtube_downloader_bytes %s" %self.bytes,
+                  "# HELP youtube_downloader_retries Download retries in the last batch.",
+                  "# TYPE youtube_downloader_retries gauge",
+                  "youtube_downloader_retries %s" %self.retries,
+                  "# HELP youtube_downloader_stage_seconds Time spent in each stage in the last batch.",
+                  "# TYPE youtube_downloader_stage_seconds summary"]
+        for stage, _ in self.stages:
+            lines.append('youtube_downloader_stage_seconds_sum{stage="%s"} %.6f' %(stage, self.stage_sums[stage]))
+            lines.append('youtube_downloader_stage_seconds_count{stage="%s"} %s' %(stage, self.stage_counts[stage]))
+        lines += ["# HELP youtube_downloader_last_batch_timestamp_seconds Time the last stream of the batch finished.",
+                  "# TYPE youtube_downloader_last_batch_timestamp_seconds gauge",
+                  "youtube_downloader_last_batch_timestamp_seconds %.3f" %time.time()]
+        return lines
@@ -0,0 +1,102 @@
+import collections
+import threading
+import hashlib
+import shutil
+import json
+import time
+import os
+
+def get_output_key(video_id, chosen_format, start_time, end_time, variant=''):
+    # returns the key of a finished output, the same video, format and trim always give the same key.
+    # variant describes the settings that change the output file, such as the trim mode
+    key = "%s|%s|%s|%s" %(video_id, chosen_format, start_time, end_time)
+    if variant:
+        key += "|" + variant
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def link_or_copy(src_path, dest_path):
+    # hardlink the file to the destination, copying it when the file system can't link them
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+
+class Output_Cache():
+    """ Keeps a copy of every finished download so the same video, format and trim can be provided
+        again without the network or ffmpeg. Files are stored under their key with an index of
+        their sizes, the least recently used files are evicted once the cache is larger than the
+        maximum size """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.load()
+
+    def load(self):
+        # read the index, a missing or corrupt index leaves the cache empty
+        try:
+            with open(self.index_path, 'r') as index_file:
+                entries = json.load(index_file)
+        except (IOError, ValueError):
+            return
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["used"]):
+            self.entries[key] = entry
+
+    def save(self):
+        # write the index to disk, must be called holding the lock. The file is replaced atomically
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.entries, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def get_size(self):
+        # returns the total size in bytes of the cached files
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def fetch(self, key, dest_path):
+        # provide the cached output at the destination, returns False if it isn't cached
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            cached_path = os.path.join(self.directory, entry["file"])
+            try:
+                link_or_copy(cached_path, dest_path)
+            except (IOError, OSError):
+                # the cached file has been removed, forget it
+                del self.entries[key]
+                self.save()
+                return False
+            entry["used"] = time.time()
+            self.entries.move_to_end(key)
+            self.save()
+        return True
+
+    def store(self, key, src_path):
+        # add a finished output to the cache and evict the least recently used files if needed
+        size = os.path.getsize(src_path)
+        if not self.max_size or size > self.max_size:
+            return
+        file_name = key + os.path.splitext(src_path)[1]
+        with self.lock:
+            if key in self.entries:
+                return
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            link_or_copy(src_path, os.path.join(self.directory, file_name))
+            self.entries[key] = {"file": file_name, "size": size, "used": time.time()}
+            self.evict()
+            self.save()
+
+    def evict(self):
+        # remove the least recently used files until the cache fits in the maximum size, must be
+        # called holding the lock
+        total = self.get_size()
+        while total > self.max_size and self.entries:
+            key, entry = self.entries.popitem(last=False)
+            total -= entry["size"]
+            cached_path = os.path.join(self.directory, entry["file"])
+            if os.path.isfile(cached_path):
+                os.remove(cached_path)
@@ -0,0 +1,349 @@
+import struct
+from http_download import Http_Download
+
+# EBML element IDs used to find the cues of a WebM file
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+
+class Clip_Index_Error(Exception):
+    """ Raised when a stream has no index that can map a trimmed clip to byte ranges """
+    pass
+
+class Partial_Download(Http_Download):
+    """ Downloads only the part of a stream that covers a trimmed clip. The container's index (the
+        sidx box of a fragmented MP4 or the cues of a WebM file) maps the start and end time to
+        fragment/cluster byte offsets. The header of the stream is fetched followed by the fragments
+        from a margin before the start time to a margin after the end time. The timestamps in the
+        fragments are kept so the clip is cut at the original start and end time """
+    # bytes fetched from the start of the stream to find the index
+    probe_size = 65536
+
+    def __init__(self, url, start_seconds, end_seconds, margin=5, total=0, callback=None,
+                 chunk_size=16384, timeout=30, throttle=None):
+        super(Partial_Download, self).__init__(url, total, callback, chunk_size, timeout, throttle)
+        self.start_seconds = start_seconds
+        self.end_seconds = end_seconds
+        self.margin = margin
+        self.data = b''
+        self.head = None
+        self.range_start = None
+        self.range_end = None
+        # time in seconds of the first fetched fragment, the downloaded clip starts here
+        self.clip_start = 0
+
+    def plan(self):
+        # work out the header and byte range to fetch, raises Clip_Index_Error if the stream's
+        # container has no usable index. A truncated or malformed index is treated the same
+        self.ensure(8)
+        try:
+            if self.data[4:8] == b'ftyp':
+                self.plan_mp4()
+            elif self.data[:4] == struct.pack('>I', EBML_HEADER):
+                self.plan_webm()
+            else:
+                raise Clip_Index_Error("The stream is not a fragmented MP4 or WebM file")
+        except (struct.error, IndexError, ValueError, OverflowError, ZeroDivisionError) as error:
+            raise Clip_Index_Error("The stream's index can't be read: %s" %error) from error
+
+    def run(self, write):
+        # download the header and the clip's byte range passing every chunk to write
+        if self.head is None:
+            self.plan()
+        self.total = len(self.head) + self.range_end - self.range_start + 1
+        self.received = len(self.head)
+        write(self.head)
+        response = self.open({"Range": "bytes=%s-%s" %(self.range_start, self.range_end)})
+        try:
+            if response.status != 206:
+                raise IOError("The server does not support range requests")
+            self.read_response(response, write)
+        finally:
+            response.close()
+        if self.received < self.total:
+            raise IOError("Connection closed after %s of %s bytes" %(self.received, self.total))
+
+    def ensure(self, size):
+        # make sure at least the given number of bytes from the start of the stream have been fetched
+        if len(self.data) >= size:
+            return
+        end = max(size, len(self.data) + self.probe_size) - 1
+        if self.total:
+            end = min(end, self.total - 1)
+        self.data += self.fetch(len(self.data), end)
+        if len(self.data) < size:
+            raise Clip_Index_Error("The stream ended before its index was found")
+
+    def fetch(self, start, end):
+        # returns the bytes in the given inclusive range of the stream
+        response = self.open({"Range": "bytes=%s-%s" %(start, end)})
+        try:
+            if response.status != 206:
+                raise Clip_Index_Error("The server does not support range requests")
+            return response.read()
+        finally:
+            response.close()
+
+    def select(self, entries):
+        # returns the first and last (time, offset) entry to fetch. entries are ordered (start time,
+        # byte offset) pairs with a final entry marking where the last one ends
+        first = 0
+        last = len(entries) - 2
+        for number in range(len(entries) - 1):
+            if entries[number+1][0] <= self.start_seconds - self.margin:
+                first = number + 1
+            if entries[number][0] >= self.end_seconds + self.margin:
+                last = number - 1
+                break
+        if last < first:
+            raise Clip_Index_Error("The clip is outside the stream's index")
+        return first, last
+
+    # ------------------------------ fragmented MP4 ------------------------------#
+    def plan_mp4(self):
+        # find the sidx box and replace it with one that only references the fetched fragments
+        offset = 0
+        while True:
+            self.ensure(offset + 16)
+            size, box_type, header_size = self.read_box_header(offset)
+            if box_type in (b'moof', b'mdat'):
+                raise Clip_Index_Error("The MP4 stream has no sidx box")
+            if box_type == b'sidx':
+                self.ensure(offset + size)
+                break
+            if size == 0:
+                raise Clip_Index_Error("The MP4 stream has no sidx box")
+            offset += size
+        timescale, entries, first_fragment = self.parse_sidx(offset, size, header_size)
+        times = [(time / float(timescale), byte_offset) for time, byte_offset, _ in entries]
+        first, last = self.select(times)
+        self.clip_start = times[first][0]
+        # the bytes between the sidx box and the first fragment are kept, the new sidx skips them too
+        new_sidx = self.build_sidx(timescale, entries[first:last+2], first_fragment - offset - size)
+        self.ensure(first_fragment)
+        self.head = self.data[:offset] + new_sidx + self.data[offset+size:first_fragment]
+        self.range_start = entries[first][1]
+        self.range_end = entries[last+1][1] - 1
+
+    def read_box_header(self, offset):
+        # returns the size, type and header size of the MP4 box at the offset
+        size, box_type = struct.unpack('>I4s', self.data[offset:offset+8])
+        if size == 1:
+            size = struct.unpack('>Q', self.data[offset+8:offset+16])[0]
+            return size, box_type, 16
+        return size, box_type, 8
+
+    def parse_sidx(self, offset, size, header_size):
+        # returns the timescale, a list of (start time, byte offset, reference) for every fragment with
+        # a final entry for the end of the last fragment, and the offset of the first fragment
+        position = offset + header_size
+        version = self.data[position]
+        reference_id, timescale = struct.unpack('>II', self.data[position+4:position+12])
+        position += 12
+        if version == 0:
+            earliest_time, first_offset = struct.unpack('>II', self.data[position:position+8])
+            position += 8
+        else:
+            earliest_time, first_offset = struct.unpack('>QQ', self.data[position:position+16])
+            position += 16
+        reference_count = struct.unpack('>H', self.data[position+2:position+4])[0]
+        position += 4
+        if position + reference_count * 12 > offset + size:
+            raise Clip_Index_Error("The sidx box is truncated")
+        self.sidx_reference_id = reference_id
+        byte_offset = offset + size + first_offset
+        time = earliest_time
+        entries = []
+        for _ in range(reference_count):
+            reference, duration, sap = struct.unpack('>III', self.data[position:position+12])
+            position += 12
+            if reference & 0x80000000:
+                raise Clip_Index_Error("Nested sidx boxes are not supported")
+            entries.append((time, byte_offset, (reference, duration, sap)))
+            time += duration
+            byte_offset += reference & 0x7FFFFFFF
+        entries.append((time, byte_offset, None))
+        return timescale, entries, offset + size + first_offset
+
+    def build_sidx(self, timescale, entries, first_offset=0):
+        # returns a version 1 sidx box referencing the given fragments, the first fragment starts
+        # first_offset bytes after the box
+        references = b''.join(struct.pack('>III', *reference) for _, _, reference in entries[:-1])
+        body = (struct.pack('>B3xII', 1, self.sidx_reference_id, timescale) +
+                struct.pack('>QQ', entries[0][0], first_offset) +
+                struct.pack('>HH', 0, len(entries) - 1) + references)
+        return struct.pack('>I4s', len(body) + 8, b'sidx') + body
+
+    # ---------------------------------- WebM ------------------------------------#
+    def plan_webm(self):
+        # find the cues, blank them out of the header and fetch the clusters covering the clip
+        offset = self.skip_element(0)
+        element_id, size, data_start = self.read_element(offset)
+        if element_id != SEGMENT:
+            raise Clip_Index_Error("The WebM stream has no segment")
+        segment_size_offset = offset + len(self.encode_id(SEGMENT))
+        segment_start = data_start
+        timecode_scale = 1000000
+        cues = None
+        cues_position = None
+        offset = segment_start
+        while True:
+            element_id, size, data_start = self.read_element(offset)
+            if element_id == CLUSTER:
+                break
+            self.ensure(data_start + size)
+            if element_id == INFO:
+                timecode_scale = self.find_uint(data_start, data_start + size, TIMECODE_SCALE) or timecode_scale
+            elif element_id == SEEK_HEAD:
+                cues_position = self.find_cues_position(data_start, data_start + size)
+            elif element_id == CUES:
+                cues = (offset, data_start, size)
+            offset = data_start + size
+        first_cluster = offset
+        head = bytearray(self.data[:first_cluster])
+        # the segment no longer has its original size
+        size_length = self.vint_length(head[segment_size_offset])
+        head[segment_size_offset:segment_size_offset+size_length] = self.unknown_size(size_length)
+        if cues:
+            # the cue positions don't match the fetched file, hide the cues so ffmpeg doesn't seek with them
+            cue_offset, cue_data_start, cue_size = cues
+            cue_points = self.parse_cues(cue_data_start, cue_data_start + cue_size)
+            element_length = cue_data_start + cue_size - cue_offset
+            head[cue_offset:cue_offset+9] = bytes([VOID]) + self.encode_size(element_length - 9, 8)
+        elif cues_position is not None:
+            cue_points = self.fetch_cues(segment_start + cues_position)
+        else:
+            raise Clip_Index_Error("The WebM stream has no cues")
+        if not cue_points:
+            raise Clip_Index_Error("The WebM stream has no cues")
+        end_of_clusters = self.total or None
+        entries = [(time * timecode_scale / 1e9, segment_start + position) for time, position in cue_points]
+        if cues_position is not None and not cues:
+            # cues stored after the clusters mark the end of the last cluster
+            end_of_clusters = segment_start + cues_position
+        if not end_of_clusters:
+            raise Clip_Index_Error("The size of the WebM stream is unknown")
+        entries.append((float('inf'), end_of_clusters))
+        first, last = self.select(entries)
+        self.clip_start = entries[first][0]
+        self.head = bytes(head)
+        self.range_start = entries[first][1]
+        self.range_end = entries[last+1][1] - 1
+
+    def vint_length(self, first_byte):
+        # returns the length of an EBML variable size integer from its first byte
+        for length in range(1, 9):
+            if first_byte & (0x80 >> (length - 1)):
+                return length
+        raise Clip_Index_Error("Invalid EBML variable size integer")
+
+    def read_vint(self, offset, keep_marker=False):
+        # returns the value and length of the EBML variable size integer at the offset
+        self.ensure(offset + 1)
+        length = self.vint_length(self.data[offset])
+        self.ensure(offset + length)
+        value = self.data[offset]
+        if not keep_marker:
+            value &= (0xFF >> length)
+        for byte in self.data[offset+1:offset+length]:
+            value = (value << 8) | byte
+        return value, length
+
+    def read_element(self, offset):
+        # returns the ID, data size and data offset of the EBML element at the offset
+        element_id, id_length = self.read_vint(offset, keep_marker=True)
+        size, size_length = self.read_vint(offset + id_length)
+        return element_id, size, offset + id_length + size_length
+
+    def skip_element(self, offset):
+        # returns the offset after the EBML element at the offset
+        element_id, size, data_start = self.read_element(offset)
+        return data_start + size
+
+    def read_uint(self, start, size):
+        # returns the unsigned integer stored in an EBML element's data
+        value = 0
+        for byte in self.data[start:start+size]:
+            value = (value << 8) | byte
+        return value
+
+    def find_uint(self, start, end, wanted_id):
+        # returns the value of the first child element with the given ID, or None
+        offset = start
+        while offset < end:
+            element_id, size, data_start = self.read_element(offset)
+            if element_id == wanted_id:
+                return self.read_uint(data_start, size)
+            offset = data_start + size
+        return None
+
+    def find_cues_position(self, start, end):
+        # returns the position of the cues relative to the segment from the seek head, or None
+        offset = start
+        while offset < end:
+            element_id, size, data_start = self.read_element(offset)
+            if element_id == SEEK:
+                seek_id = self.find_uint(data_start, data_start + size, SEEK_ID)
+                if seek_id == CUES:
+                    return self.find_uint(data_start, data_start + size, SEEK_POSITION)
+            offset = data_start + size
+        return None
+
+    def fetch_cues(self, cue_offset):
+        # returns the cue points of cues stored after the clusters, they are fetched and parsed on their own
+        cues = Partial_Download(self.url, self.start_seconds, self.end_seconds, timeout=self.timeout)
+        cues.data = self.fetch(cue_offset, cue_offset + 15)
+        element_id, cue_size, cue_data_start = cues.read_element(0)
+        if element_id != CUES:
+            raise Clip_Index_Error("The WebM seek head points to the wrong position for the cues")
+        cues.data = self.fetch(cue_offset, cue_offset + cue_data_start + cue_size - 1)
+        cues.total = len(cues.data)
+        return cues.parse_cues(cue_data_start, cue_data_start + cue_size)
+
+    def parse_cues(self, start, end):
+        # returns a list of (time, cluster position) for every cue point ordered by time
+        cue_points = []
+        offset = start
+        while offset < end:
+            element_id, size, data_start = self.read_element(offset)
+            if element_id == CUE_POINT:
+                time = self.find_uint(data_start, data_start + size, CUE_TIME)
+                position = None
+                track_offset = data_start
+                while track_offset < data_start + size and position is None:
+                    child_id, child_size, child_start = self.read_element(track_offset)
+                    if child_id == CUE_TRACK_POSITIONS:
+                        position = self.find_uint(child_start, child_start + child_size, CUE_CLUSTER_POSITION)
+                    track_offset = child_start + child_size
+                if time is not None and position is not None:
+                    cue_points.append((time, position))
+            offset = data_start + size
+        # several tracks can share a cluster, keep one cue per cluster
+        unique = sorted(set(cue_points))
+        return [point for number, point in enumerate(unique)
+                if number == 0 or point[1] != unique[number-1][1]]
+
+    def encode_id(self, element_id):
+        # returns the bytes of an EBML element ID
+        length = (element_id.bit_length() + 7) // 8
+        return element_id.to_bytes(length, 'big')
+
+    def encode_size(self, size, length):
+        # returns an EBML variable size integer of the given length
+        return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+
+    def unknown_size(self, length):
+        # returns an EBML size of the given length that marks the size as unknown
+        return ((1 << (7 * length + 1)) - 1).to_bytes(length, 'big')
@@ -0,0 +1,62 @@
+import pafy
+import re
+from metadata_cache import extract_video_id
+
+# matches the ID of a playlist in a youtube URL
+PLAYLIST_ID_PATTERN = re.compile(r'[?&]list=([\w-]+)')
+# matches the ID of a channel in a youtube channel URL
+CHANNEL_ID_PATTERN = re.compile(r'youtube\.com/channel/(UC[\w-]+)')
+# matches a channel named by its user name, custom URL or handle
+CHANNEL_NAME_PATTERN = re.compile(r'youtube\.com/(?:user/|c/|@)[\w.-]+')
+
+def is_playlist_url(url):
+    # checks if the URL names a playlist or channel rather than a single video. A video opened
+    # from a playlist has both IDs and is treated as the single video
+    if extract_video_id(url):
+        return False
+    return bool(PLAYLIST_ID_PATTERN.search(url) or CHANNEL_ID_PATTERN.search(url)
+                or CHANNEL_NAME_PATTERN.search(url))
+
+def get_video_url(video_id):
+    # returns the watch URL of a video
+    return "https://www.youtube.com/watch?v=" + video_id
+
+def expand_url(url):
+    # returns the URL of every video in a playlist or a channel's uploads, in playlist order.
+    # Raises the pafy exception if the playlist can't be found
+    channel = CHANNEL_ID_PATTERN.search(url)
+    if channel:
+        # the uploads playlist of a channel has the channel's ID with 'UU' in place of 'UC'
+        return get_playlist_urls('UU' + channel.group(1)[2:])
+    playlist = PLAYLIST_ID_PATTERN.search(url)
+    if playlist:
+        return get_playlist_urls(playlist.group(1))
+    # a channel named by user name or handle has to be looked up to find its uploads
+    return [get_video_url(video.videoid) for video in pafy.get_channel(url).uploads]
+
+def get_playlist_urls(playlist_id):
+    # returns the URL of every video in a playlist. pafy builds a video object for every item, with
+    # basic, gdata and size off it doesn't fetch their details. Only the IDs from the playlist's
+    # own data are used, each video is looked up when its stream is resolved
+    playlist = pafy.get_playlist(playlist_id, basic=False, gdata=False, size=False)
+    return [get_video_url(item["playlist_meta"]["encrypted_id"]) for item in playlist["items"]]
+
+def expand_stream_meta(stream_meta):
+    # returns the stream meta of every video in a playlist or channel entry, each video keeps the
+    # entry's format and trim times. Any other entry is returned as it is
+    if not is_playlist_url(stream_meta["url"]):
+        return [stream_meta]
+    items = []
+    for url in expand_url(stream_meta["url"]):
+        item = dict(stream_meta)
+        item["url"] = url
+        items.append(item)
+    return items
+
+def get_expand_error(url, error):
+    # returns the message shown when a playlist or channel couldn't be expanded
+    if isinstance(error, (IOError, ValueError)):
+        return 'Playlist not found: %s' %url
+    print(error)
+    return ('An unexpected error occurred when searching for playlist '
+            '\'%s\', please try again.' %url)
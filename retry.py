@@ -0,0 +1,77 @@
+import urllib.error
+import email.utils
+import random
+import time
+
+# the kinds of download errors the retry policy tells apart
+TRANSIENT = 'transient'
+RATE_LIMITED = 'rate-limited'
+EXPIRED_URL = 'expired-URL'
+PERMANENT = 'permanent'
+
+class Retry_Policy():
+    """ Decides whether and when a failed download is attempted again. Errors are sorted into
+        transient errors (dropped connections, timeouts, server errors) which back off exponentially
+        with jitter, rate limits which also wait for the server's Retry-After, expired signed URLs
+        which are retried straight away once the stream has been looked up again, and permanent
+        errors (missing or removed videos) which are never retried """
+    # longest Retry-After in seconds that is honoured, so a bad header can't stall the queue
+    max_retry_after = 600
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, max_url_refreshes=2):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_url_refreshes = max_url_refreshes
+        self.random = random.Random()
+
+    def classify(self, error):
+        # returns the kind of error that stopped a download attempt
+        if isinstance(error, urllib.error.HTTPError):
+            if error.code == 429 or (error.code == 503 and self.get_retry_after(error) is not None):
+                return RATE_LIMITED
+            if error.code in (403, 410):
+                # googlevideo refuses signed URLs once they have expired
+                return EXPIRED_URL
+            if error.code >= 500:
+                return TRANSIENT
+            return PERMANENT
+        if isinstance(error, ValueError):
+            # pafy raises ValueError for a video ID that doesn't exist, as does looking up a video
+            # again once it has been removed
+            return PERMANENT
+        return TRANSIENT
+
+    def should_retry(self, error_class, attempts, url_refreshes=0):
+        # checks if a stream should be attempted again after attempts failed attempts
+        if error_class == PERMANENT or attempts >= self.max_attempts:
+            return False
+        if error_class == EXPIRED_URL and url_refreshes >= self.max_url_refreshes:
+            return False
+        return True
+
+    def get_delay(self, error_class, attempts, error=None):
+        # returns the number of seconds to wait before the next attempt
+        if error_class == EXPIRED_URL:
+            return 0
+        # full jitter, spreads out the retries of streams that failed at the same time
+        delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+        if error_class == RATE_LIMITED:
+            retry_after = self.get_retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+    def get_retry_after(self, error):
+        # returns the seconds the server asked to wait in its Retry-After header, or None
+        value = error.headers.get("Retry-After") if getattr(error, 'headers', None) else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
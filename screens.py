@@ -1,15 +1,25 @@
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import (filedialog, Frame, Button, Label, Spinbox, Entry, Menu, 
                      Checkbutton, Listbox, Scrollbar, Tk, HORIZONTAL, ACTIVE,
                      NORMAL, DISABLED, GROOVE, END, TclError, StringVar, BooleanVar)
 import time, datetime
-import json
 import os
 from streams import Stream_Generator
-from convert import Convert
+from downloads import Download_Queue
+from sessions import Session_Journal, load_session_file
+from events import Event_Bus
+from metrics import Metrics_Writer, get_metrics_file_path
+from bandwidth import Bandwidth_Limiter
+from retry import Retry_Policy
+from convert_scheduler import Convert_Scheduler
+from playlists import is_playlist_url, expand_stream_meta, get_expand_error
 
 class Screen(Frame):
     """ Inherited by all screen objects and provides common solutions """
+    # milliseconds between handling the events posted by worker threads
+    event_interval = 100
+
     def __init__(self, settings, **kwargs):
         self.next_window = None
         # create a Tk window object
@@ -19,6 +29,8 @@ class Screen(Frame):
         self.kwargs = kwargs
         self.settings = settings
         self.table_column_widgets = []
+        # worker threads must not touch Tk widgets, they post events which are handled on the Tk thread
+        self.event_bus = Event_Bus()
         # set screen specific variables
         self.set_screen_specific_variables()
         # create and configure window
@@ -40,6 +52,20 @@ class Screen(Frame):
             tList.yview("scroll", event.delta,"units")
         return "break"
 
+    def process_events(self):
+        # handle the events posted by worker threads, repeats at a fixed interval while the window is
+        # open. An event that fails to be handled is logged so the events after it are still handled
+        for event, key, value in self.event_bus.drain():
+            try:
+                self.handle_event(event, key, value)
+            except Exception as error:
+                print("Failed to handle the %s event for %s: %s" %(event, key, error))
+        self.after(self.event_interval, self.process_events)
+
+    def handle_event(self, event, key, value):
+        # screens that start worker threads override this to handle the events they post
+        pass
+
     # ------------------------- window transition methods -----------------------#
     def go_to_main_menu(self):
         # go to the youtube_downloader menu
@@ -182,12 +208,24 @@ class Download_Input_Screen(Screen):
         self.supported_file_formats = self.settings.get_supported_formats()
         self.default_format = self.settings.get_default_file_format()
 
-        self.session_meta = []
         self.to_download = self.kwargs["download_list"]
+        # progress of resolving streams loaded from session files
+        self.session_load_total = 0
+        self.session_load_resolved = 0
+        self.session_load_failed_urls = []
         self.control_buttons = []
         self.start_time_widgets = []
         self.end_time_widgets = []
         self.session_timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d_%H-%M-%S')
+        self.session = Session_Journal(os.getcwd()+"/sessions/"+self.session_timestamp+".jsonl")
+        # looks up the streams of session files and playlists, shared by every load so no more
+        # than resolve_workers lookups run at once
+        self.resolver = ThreadPoolExecutor(max_workers=self.settings.get_resolve_workers())
+
+    def kill_window(self):
+        # stop the lookups that haven't started and kill the screen
+        self.resolver.shutdown(wait=False, cancel_futures=True)
+        super(Download_Input_Screen, self).kill_window()
 
     def configure_window(self):
         self.master.title("Download List")
@@ -302,7 +340,7 @@ class Download_Input_Screen(Screen):
         self.scrollbar_widget_x_name = Scrollbar(orient=HORIZONTAL, command=self.track_scrollbar_x_name)
         self.scrollbar_widget_x_name.place(x=10, y=490, width=284)
         self.scrollbar_widget_x_url = Scrollbar(orient=HORIZONTAL, command=self.track_scrollbar_x_url)
-        self.scrollbar_widget_x_url.place(x=294, y=490, width=275)
+        self.scrollbar_widget_x_url.place(x=294, y=490, width=215)
 
         # draw columns and labels
         Label(borderwidth=1, relief=GROOVE, text='Name', font=('times',10,'bold'), width=40).place(x=9, y=102)
@@ -315,16 +353,25 @@ class Download_Input_Screen(Screen):
                                     height=23)
         self.name_list_widget.place(x=9, y=120)
         self.name_list_widget.bind("<MouseWheel>", self.on_mouse_wheel_table_y)
-        Label(borderwidth=1, relief=GROOVE, text='URL',font=('times',10,'bold'), width=39).place(x=293, y=102)
+        Label(borderwidth=1, relief=GROOVE, text='URL',font=('times',10,'bold'), width=30).place(x=293, y=102)
         self.url_list_widget = Listbox(highlightthickness=0,
                                     selectmode="multiple",
                                     yscrollcommand=self.scrollbar_widget_y.set,
                                     xscrollcommand=self.scrollbar_widget_x_url.set,
                                     exportselection=False,
-                                    width=46,
+                                    width=36,
                                     height=23)
         self.url_list_widget.place(x=293,y=120)
         self.url_list_widget.bind("<MouseWheel>", self.on_mouse_wheel_table_y)
+        Label(borderwidth=1, relief=GROOVE, text='Size', font=('times',10,'bold'), width=9).place(x=508, y=102)
+        self.size_list_widget = Listbox(highlightthickness=0,
+                                    selectmode="multiple",
+                                    yscrollcommand=self.scrollbar_widget_y.set,
+                                    exportselection=False,
+                                    width=10,
+                                    height=23)
+        self.size_list_widget.place(x=508, y=120)
+        self.size_list_widget.bind("<MouseWheel>", self.on_mouse_wheel_table_y)
         Label(borderwidth=1, relief=GROOVE,text='Format',font=('times',10,'bold'),width=11).place(x=568, y=102)
         self.format_list_widget = Listbox(highlightthickness=0,
                                     selectmode="multiple",
@@ -375,6 +422,7 @@ class Download_Input_Screen(Screen):
         self.table_column_widgets.extend((
                                           self.name_list_widget,
                                           self.url_list_widget,
+                                          self.size_list_widget,
                                           self.format_list_widget,
                                           self.con_req_list_widget,
                                           self.start_time_list_widget,
@@ -401,6 +449,21 @@ class Download_Input_Screen(Screen):
 
     def prepare_window(self):
         self.add_download_list_to_table()
+        self.process_events()
+
+    def handle_event(self, event, key, value):
+        # handle the results of the URL and session lookups running in worker threads
+        if event == 'stream_resolved':
+            self.session_stream_resolved(value)
+        elif event == 'user_stream':
+            self.add_user_stream(value)
+        elif event == 'user_stream_failed':
+            self.change_status(value, colour="red")
+            self.reset_control_widgets()
+        elif event == 'playlist_expanded':
+            self.playlist_expanded(value)
+        elif event == 'playlist_failed':
+            self.playlist_failed(value)
 
     def track_scrollbar_x_name(self,*args):
         # Move side to side in the name list box via a scroll bar
@@ -486,13 +549,10 @@ class Download_Input_Screen(Screen):
         # Delete entire row(s) of a table and remove from download list
         ordered_lines = sorted(self.selected_lines, reverse=True)
         for line in ordered_lines:
-            for tList in self.table_column_widgets:
-                tList.delete(first=line)
-            del self.to_download[int(line)]
-            del self.session_meta[int(line)]
+            self.remove_row(int(line))
+        self.selected_lines = ()
         self.delete_button.configure(state=DISABLED)
         self.edit_button.configure(state=DISABLED)
-        self.update_session_file()
 
     def add_download_list_to_table(self):
         # Add the contents of the download list to the table
@@ -512,68 +572,181 @@ class Download_Input_Screen(Screen):
         self.status_label.config(text=message, fg=colour)
 
     def add_stream_meta_to_session_file(self, url, chosen_format, start_time, end_time):
-        # update the session dict with the latest stream added and update the file
-        self.session_meta.append({"url": url,
-                                  "chosen_format": chosen_format,
-                                  "start_time": str(start_time),
-                                  "end_time": str(end_time)})
-        self.update_session_file()
-
-    def update_session_file(self):
-        # Update the json file with the current download list
-        with open((os.getcwd()+"/sessions/"+self.session_timestamp+".json"),"w") as session_file:
-            json.dump(self.session_meta, session_file, indent=4, sort_keys=True)
+        # append the latest stream added to the session journal
+        self.session.add(url, chosen_format, start_time, end_time)
 
     def add_session_file_streams(self, session_contents):
-        # Add a session json to the download list and table
-        total_sessions = len(session_contents)
-        GUI_meta = []
-        failed_urls = []
-        for session_count, stream_meta in enumerate(session_contents):
-            self.change_status("Loading session %s of %s... " %(session_count+1, total_sessions), colour="red")
-            success, output = self.submit_stream(stream_meta)
-            if success:
-                GUI_meta.append(output)
-            else:
-                failed_urls.append(stream_meta["url"])
-        if not failed_urls:
+        # Add the streams of a session file to the download list and table. Every stream is given a
+        # placeholder row straight away and is resolved concurrently in the background, each row is
+        # filled in as soon as its stream has been resolved. Playlist and channel entries are
+        # expanded in the background and their videos are added the same way
+        streams = []
+        playlists = []
+        for stream_meta in session_contents:
+            if is_playlist_url(stream_meta["url"]):
+                playlists.append(stream_meta)
+                continue
+            stream = self.build_stream(stream_meta)
+            self.to_download.append(stream)
+            self.add_stream_meta_to_session_file(stream_meta["url"], stream_meta["chosen_format"],
+                                                 stream_meta["start_time"], stream_meta["end_time"])
+            self.add_placeholder_to_GUI_list(stream_meta)
+            streams.append(stream)
+        self.session_load_total += len(streams) + len(playlists)
+        self.update_session_load_status()
+        for stream_meta in playlists:
+            self.resolver.submit(self.expand_playlist, stream_meta)
+        for stream in streams:
+            self.resolver.submit(self.resolve_session_stream, stream)
+
+    def resolve_session_stream(self, stream):
+        # Resolve a stream loaded from a session file, runs in a background thread
+        stream.generate()
+        self.event_bus.post('stream_resolved', value=stream)
+
+    def expand_playlist(self, stream_meta):
+        # Find the videos of a playlist or channel entry, runs in a background thread
+        try:
+            self.event_bus.post('playlist_expanded', value=expand_stream_meta(stream_meta))
+        except Exception as error:
+            print(get_expand_error(stream_meta["url"], error))
+            self.event_bus.post('playlist_failed', value=stream_meta["url"])
+
+    def playlist_expanded(self, stream_meta_list):
+        # Add the videos of an expanded playlist, they are resolved like the streams of a session
+        self.session_load_resolved += 1
+        self.add_session_file_streams(stream_meta_list)
+
+    def playlist_failed(self, url):
+        # Report a playlist or channel that couldn't be found
+        self.session_load_resolved += 1
+        self.session_load_failed_urls.append(url)
+        self.update_session_load_status()
+
+    def session_stream_resolved(self, stream):
+        # Fill in the row of a resolved session stream, or remove it if the stream failed
+        self.session_load_resolved += 1
+        position = self.get_download_list_position(stream)
+        if position is None:
+            # the row was deleted while the stream was being resolved
+            stream.release_file_path()
+        elif stream.get_errors():
+            self.session_load_failed_urls.append(stream.get_url())
+            self.remove_row(position)
+        else:
+            self.update_GUI_row(position, stream)
+        self.update_session_load_status()
+
+    def update_session_load_status(self):
+        # Show how many streams of the loaded session(s) and playlists have been resolved
+        if self.session_load_resolved < self.session_load_total:
+            self.change_status("Resolving %s of %s... " %(self.session_load_resolved+1,
+                                                           self.session_load_total), colour="red")
+            return
+        if not self.session_load_failed_urls:
             self.change_status("Ok")
         else:
-            self.change_status("Failed to add: %s" %(", ".join(failed_urls)), colour="red")
-        self.after(0, self.add_to_GUI_list, GUI_meta)
+            self.change_status("Failed to add: %s" %(", ".join(self.session_load_failed_urls)), colour="red")
+        self.session_load_total = 0
+        self.session_load_resolved = 0
+        self.session_load_failed_urls = []
+
+    def get_download_list_position(self, stream):
+        # returns the position of the stream object in the download list or None if it was deleted
+        for position, listed_stream in enumerate(self.to_download):
+            if listed_stream is stream:
+                return position
+        return None
+
+    def is_resolving(self):
+        # checks if any stream in the download list is still being resolved
+        return self.session_load_resolved < self.session_load_total
 
     def submit_user_input(self, input_meta):
         # Get a stream object from the input metadata and handle any errors
-        success, output = self.submit_stream(input_meta)
+        success, output = self.create_stream(input_meta)
         if success:
-            self.add_to_GUI_list([output])
-            self.change_status("Ok")
+            self.event_bus.post('user_stream', value=output)
+        else:
+            self.event_bus.post('user_stream_failed', value=output)
+
+    def add_user_stream(self, stream):
+        # Add a stream submitted by the user to the download list and table
+        self.add_stream_to_download_list(stream)
+        self.add_to_GUI_list([stream])
+        if self.is_resolving():
+            self.update_session_load_status()
         else:
-            self.change_status(output, colour="red")
-            self.reset_control_widgets()            
+            self.change_status("Ok")
 
-    def submit_stream(self, stream_meta):
-        # Creates a stream object based on some meta data.
-        # A boolean is returned from this method as well as the
-        # stream object to show if the stream was successfully created
+    def build_stream(self, stream_meta):
+        # Creates a stream object based on some meta data, the stream is not resolved yet
         format_type = self.settings.get_format_type(stream_meta["chosen_format"])
         download_directory = self.settings.get_download_directory()
-        stream = Stream_Generator(stream_meta["url"], stream_meta["start_time"],
-                                  stream_meta["end_time"], format_type,
-                                  stream_meta["chosen_format"], download_directory)
+        return Stream_Generator(stream_meta["url"], stream_meta["start_time"],
+                                stream_meta["end_time"], format_type,
+                                stream_meta["chosen_format"], download_directory,
+                                metadata_cache=self.kwargs["metadata_cache"],
+                                file_names=self.kwargs["file_names"],
+                                max_video_height=self.settings.get_max_video_height(),
+                                max_video_bitrate=self.settings.get_max_video_bitrate())
+
+    def create_stream(self, stream_meta):
+        # Creates and resolves a stream object based on some meta data without adding it to the download list.
+        # Returns a boolean for whether the stream was successfully created along with the
+        # stream object or the error message
+        stream = self.build_stream(stream_meta)
         stream.generate()
         if stream.get_errors():
             return False, stream.get_errors()
+        return True, stream
+
+    def add_stream_to_download_list(self, stream):
+        # Add a created stream to the download list and the session file
         self.to_download.append(stream)
         self.add_stream_meta_to_session_file(stream.get_url(), stream.get_chosen_format(),
                                              stream.get_start_time(), stream.get_end_time())
-        return True, stream
+
+    def add_placeholder_to_GUI_list(self, stream_meta):
+        # Adds a row to the table GUI for a stream that is still being resolved
+        self.name_list_widget.insert(END, "Resolving...")
+        self.url_list_widget.insert(END, stream_meta["url"])
+        self.size_list_widget.insert(END, "")
+        self.format_list_widget.insert(END, stream_meta["chosen_format"])
+        self.con_req_list_widget.insert(END, "")
+        self.start_time_list_widget.insert(END, stream_meta["start_time"] or "")
+        self.end_time_list_widget.insert(END, stream_meta["end_time"] or "")
+        self.duration_list_widget.insert(END, "")
+
+    def update_GUI_row(self, position, stream):
+        # Replace the cells in a row of the table GUI with the meta of a resolved stream
+        if stream.is_convert_required():
+            convert_required = "Yes"
+        else:
+            convert_required = "No"
+        row = (stream.get_title(), stream.get_url(), self.format_size(stream), stream.get_chosen_format(),
+               convert_required, stream.get_start_time(), stream.get_end_time(), stream.get_duration())
+        for tList, value in zip(self.table_column_widgets, row):
+            selected = tList.selection_includes(position)
+            tList.delete(position)
+            tList.insert(position, value)
+            if selected:
+                tList.selection_set(position)
+
+    def remove_row(self, position):
+        # Remove a row from the table, download list and session
+        for tList in self.table_column_widgets:
+            tList.delete(first=position)
+        self.to_download[position].release_file_path()
+        del self.to_download[position]
+        self.session.delete(position)
 
     def add_to_GUI_list(self, streams):
         # Adds stream meta to the table GUI
         for stream in streams:
             self.name_list_widget.insert(END, stream.get_title())
             self.url_list_widget.insert(END, stream.get_url())
+            self.size_list_widget.insert(END, self.format_size(stream))
             self.format_list_widget.insert(END, stream.get_chosen_format())
             if stream.is_convert_required():
                 self.con_req_list_widget.insert(END, "Yes")
@@ -584,31 +757,29 @@ class Download_Input_Screen(Screen):
             self.duration_list_widget.insert(END, stream.get_duration())
         self.reset_control_widgets()
 
+    def format_size(self, stream):
+        # returns the size the stream is expected to download in MB, marked '~' when it is estimated
+        size, size_known = stream.get_estimated_size()
+        return "%s%.1f MB" %("" if size_known else "~", size / (1024.0 * 1024))
+
     def clear_session(self):
         # Empty table and download list
+        for stream in self.to_download:
+            stream.release_file_path()
         self.to_download = []
-        self.session_meta = []
         for tList in self.table_column_widgets:
             tList.delete(first=0, last=END)
         self.reset_control_widgets()
-        self.update_session_file()
+        self.session.clear()
 
     def load_session_pressed(self):
-        # Reads a json session file and creates a thread to add it to the download table and list
+        # Reads a session file and creates a thread to add it to the download table and list
         session_file_location = filedialog.askopenfilename(initialdir="sessions")
         if not session_file_location:
             return
         self.change_status("Reading session file \'%s\'..." %session_file_location, colour="red")
-        with open(session_file_location,'r') as session_file:
-            session_contents = json.load(session_file)
-        self.disable_all_control_widgets()
-        self.session_contents = session_contents
-        self.add_session_thread=threading.Thread(target=self.add_session_file_streams, args=(session_contents,))
-        self.add_session_thread.daemon = True
-        try:
-            self.add_session_thread.start()
-        except TclError:
-            pass
+        session_contents = load_session_file(session_file_location)
+        self.add_session_file_streams(session_contents)
 
     def add_pressed(self):
         # Collect input data from entry fields and create a thread to check and add the URL
@@ -628,6 +799,13 @@ class Download_Input_Screen(Screen):
                                     self.end_time_inputs[0].get() + ":" +
                                     self.end_time_inputs[1].get() + ":" +
                                     self.end_time_inputs[2].get())
+        if is_playlist_url(input_meta["url"]):
+            # every video of the playlist is added with the chosen format and trim times
+            input_meta["start_time"] = input_meta["start_time"] or ""
+            input_meta["end_time"] = input_meta["end_time"] or ""
+            self.add_session_file_streams([input_meta])
+            self.reset_control_widgets()
+            return
         self.change_status("Checking URL", colour="red")
         self.disable_all_control_widgets()
         self.add_url_thread=threading.Thread(target=self.submit_user_input, args=(input_meta,))
@@ -640,8 +818,11 @@ class Download_Input_Screen(Screen):
     def edit_pressed(self):
         # Add all input data for the selected stream back into the entry boxes
         # and remove from the table.
-        self.reset_control_widgets() #clear existing input
         stream = self.to_download[int(self.selected_lines[0])]
+        if not stream.is_generated():
+            self.change_status("Wait for the video to be resolved before editing it", colour="red")
+            return
+        self.reset_control_widgets() #clear existing input
         # place in URL
         self.url_input_widget.insert(0, stream.get_url())
         # place in file format
@@ -666,7 +847,10 @@ class Download_Input_Screen(Screen):
         self.delete_from_list()
 
     def start_pressed(self):
-        # Go to the download screen
+        # Go to the download screen once every stream has been resolved
+        if self.is_resolving():
+            self.change_status("Wait for every video to be resolved before starting", colour="red")
+            return
         self.go_to_download_streams_screen()
 
     def back_pressed(self):
@@ -676,19 +860,45 @@ class Download_Input_Screen(Screen):
     def get_download_list(self):
         # Return the download list
         return self.to_download
+
+    def get_session_file(self):
+        # Return the path of the current session file
+        return self.session.file_path
     
             
 class Download_Streams(Screen):
     """ Download and monitors all streams from the download list"""
 
     def set_screen_specific_variables(self):
-        self.error_list = []
-        self.count = None
-        self.force_stop_download = False
-        self.download_process_running = False
         self.previous_button_widget_text = "Cancel"
-        self.download_struc_pointer = -1
-        self.download_struc = self.structure_download_list(self.kwargs["download_list"])
+        self.download_queue = Download_Queue(self.kwargs["download_list"],
+                                             workers=self.settings.get_download_workers(),
+                                             convert_workers=self.settings.get_convert_workers(),
+                                             exact_trim=self.settings.get_exact_trim(),
+                                             pipe_convert_formats=self.settings.get_pipe_convert_formats(),
+                                             segments=self.settings.get_download_segments(),
+                                             partial_fetch_margin=self.settings.get_partial_fetch_margin(),
+                                             bandwidth_limiter=Bandwidth_Limiter(self.settings.get_max_rate(),
+                                                                                 self.settings.get_max_stream_rate(),
+                                                                                 self.settings.get_bandwidth_schedule()),
+                                             retry_policy=Retry_Policy(self.settings.get_retry_max_attempts(),
+                                                                       self.settings.get_retry_base_delay(),
+                                                                       self.settings.get_retry_max_delay(),
+                                                                       self.settings.get_retry_max_url_refreshes()),
+                                             output_cache=self.kwargs["output_cache"],
+                                             metrics_writer=self.create_metrics_writer(),
+                                             convert_scheduler=Convert_Scheduler(self.settings.get_convert_workers(),
+                                                                                 self.settings.get_convert_niceness()),
+                                             status_callback=self.post_download_status,
+                                             progress_callback=self.post_download_progress,
+                                             finished_callback=self.post_download_finished)
+
+    def create_metrics_writer(self):
+        # returns a writer for the timings of every stream, kept next to the session file, or None
+        if not self.settings.get_write_metrics():
+            return None
+        return Metrics_Writer(get_metrics_file_path(self.kwargs["session_file"]),
+                              self.settings.get_prometheus_file())
 
     def configure_window(self):
         self.master.title("Download Progress")
@@ -785,6 +995,34 @@ class Download_Streams(Screen):
     def prepare_window(self):
         self.add_download_meta_to_table()
         self.start_download()
+        self.process_events()
+
+    def handle_event(self, event, key, value):
+        # apply the latest status and progress posted by the workers for each row
+        if event == 'finished':
+            if self.download_queue.is_cancelled():
+                self.close_after_cancel()
+            else:
+                self.download_finished()
+        elif self.download_queue.is_cancelled():
+            # rows have already been marked as cancelled
+            return
+        elif event == 'status':
+            self.update_download_status(key, value)
+        elif event == 'progress':
+            self.update_download_progress(key, value)
+
+    def post_download_status(self, position, status):
+        # called from a worker thread when the status of a stream changes
+        self.event_bus.post('status', position, status)
+
+    def post_download_progress(self, position, progress):
+        # called from a worker thread on every chunk downloaded, only the latest value is kept
+        self.event_bus.post('progress', position, progress)
+
+    def post_download_finished(self):
+        # called from a worker thread once every worker has stopped
+        self.event_bus.post('finished')
 
     def track_scrollbar_x_name(self, *args):
         # Move side to side in the name list box via a scroll bar
@@ -818,178 +1056,56 @@ class Download_Streams(Screen):
 
     def add_download_meta_to_table(self):
         # adds the stream meta to the on screen table table
-        for position in self.download_struc.keys():
-            stream_meta = self.download_struc[position]
+        download_struc = self.download_queue.get_download_struc()
+        for position in download_struc.keys():
+            stream_meta = download_struc[position]
             stream = stream_meta['stream']
             self.name_list_widget.insert(END, stream.get_title())
             self.url_list_widget.insert(END, stream.get_url())
             self.progress_list_widget.insert(END, stream_meta['progress'])
             self.status_list_widget.insert(END, stream_meta['status'])
 
-    def structure_download_list(self, download_list):
-        # generates and returns a dictionary that orders the streams by a number as tracking
-        # each streams download status and progress. The structure should look like the following:
-        #
-        # {
-        #     '1': {
-        #           'stream': <stream_obj>,
-        #           'status': 'Queued',
-        #           'progress': ''
-        #          },
-        #     '2': {
-        #           'stream': <stream_obj>,
-        #           'status': 'Queued',
-        #           'progress': ''
-        #          }
-        # }
-        temp = {}
-        for position, stream in enumerate(download_list):
-            temp[position] = {
-                                 'stream': stream,
-                                 'status': 'Queued',
-                                 'progress': ''
-                                 }
-        print(temp)
-        return temp
-
-    def get_next_stream_to_download(self):
-        # returns the next stream in the download_struc for download. The position in queue
-        # pointer is incremented
-        self.download_struc_pointer += 1
-        stream = self.download_struc[self.download_struc_pointer]['stream']
-        return stream
-
-    def is_all_downloads_completed(self):
-        # determines if any items in the download_struc is queued for download, if it is then not
-        # all downloads are complete
-        for position in self.download_struc.keys():
-            if self.download_struc[position]['status'] == 'Queued':
-                return False
-        return True
-
-    def is_download_running(self):
-        # returns a boolean for if whether any streams are currently being downloaded or converted
-        return self.download_process_running
-
-    def update_download_status(self, status):
-        # updates the status of the stream being pointed to by the pointer in the download_struc and
-        # in the table on screen
-        if self.force_stop_download:
-            return
-        self.download_struc[self.download_struc_pointer]['status'] = status
-        self.update_list(self.status_list_widget, status)
+    def update_download_status(self, position, status):
+        # updates the status of a stream in the table on screen
+        self.update_list(self.status_list_widget, status, position)
 
-    def update_download_progress(self, progress):
-        # updates the progress of the stream being pointed to by the pointer in the download_struc and
-        # in the table on screen
+    def update_download_progress(self, position, progress):
+        # updates the progress of a stream in the table on screen
         spaces ='         ' # create a gap before printing displaying the percentage ('\t' not accepted)
-        if self.force_stop_download:
-            return
-        self.download_struc[self.download_struc_pointer]['progress'] = progress
-        self.update_list(self.progress_list_widget, spaces + progress + '%')
+        self.update_list(self.progress_list_widget, spaces + progress + '%', position)
 
     def start_download(self):
-        # create a thread for downloading the streams
-        self.download_thread = threading.Thread(target=self.download_streams)
-        self.download_thread.daemon = True
-        # Start stream download
+        # start the pool of download workers
         try:
-            self.download_thread.start()
+            self.download_queue.start()
         except TclError:
             pass
 
-    def download_streams(self):
-        # Downloads each stream in the download_struc
-        # downloading a streams should be attempted the following maximum number of times
-        download_attempts_limit = 3
-        self.download_process_running = True
-        while not self.is_all_downloads_completed():
-            stream = self.get_next_stream_to_download()
-            downloaded = False
-            download_attempts = 0
-            self.update_download_status('Downloading')
-            while not downloaded:
-                # check if an external condition is forcing the download process to stop
-                if self.force_stop_download:
-                    # confirm the process was stopped
-                    self.download_process_running = False
-                    return
-                # get a destination path for the download
-                if stream.is_convert_required() or stream.is_trimmed():
-                    file_path = stream.get_temp_file_path()
-                else:
-                    file_path = stream.get_file_path()
-                try:
-                    stream.get_stream().download(quiet=True,
-                                                callback=self.download_callback,
-                                                filepath=file_path)
-                    downloaded = True
-                    self.update_download_status('Done')
-                except Exception as error:
-                    download_attempts += 1
-                    print(error, download_attempts, download_attempts_limit)
-                    if download_attempts == download_attempts_limit:
-                        error_message = "Exceeded maximum download attempts - " + str(error)
-                        self.error_list.append({
-                                    "name": stream.get_title(),
-                                    "error": error_message})
-                        self.update_download_status('Error during download')
-                        break
-                    else:
-                        # pause to increase probability of the download to work on the next attempt,
-                        # if the error is due to internet connection
-                        time.sleep(1)
-                        continue
-                if (stream.is_convert_required() or stream.is_trimmed()) and downloaded and not self.force_stop_download:
-                    try:
-                        # convert the file if required(when a sub file format is used)
-                        self.update_download_status('Converting')
-                        Convert(stream.get_file_path(), stream.get_temp_file_path(),
-                                stream.get_start_time(), stream.get_end_time())
-                        self.update_download_status('Done')
-                    except Exception as error:
-                        self.error_list.append({
-                                       "name": stream.get_title(),
-                                       "error": error})
-                        self.update_download_status('Error during converting')
-                        break
-            # if one or more streams failed to download activate the error report button
-            if self.error_list:
-                self.error_report_button.configure(state=ACTIVE)
+    def download_finished(self):
+        # runs once every stream in the download list has been processed
+        # if one or more streams failed to download activate the error report button
+        if self.download_queue.get_errors():
+            self.error_report_button.configure(state=ACTIVE)
         self.flip_previous_button_text()
         self.done_button.configure(state=NORMAL)
-        # confirm the process has finished
-        self.download_process_running = False
 
     def cancel_all_downloads(self):
-        # cancels all streams for download and updates the tracking information in the download_struc
-        for position in self.download_struc.keys():
-            if position == self.download_struc_pointer:
-                status = 'Cancelling ...'
-            else:
-                status = 'Cancelled'
-            progress = ''
-            self.download_struc[position]['status'] = status
-            self.download_struc[position]['progress'] = progress
-            self.update_list(self.status_list_widget, status, position=position)
-            self.update_list(self.progress_list_widget, progress, position=position)
-            
-    def download_callback(self, total, recvd, ratio, rate, eta):
-        # Updates download progress for a stream
-        progress = int(ratio*100)
-        self.update_download_progress(str(progress))
+        # cancels all streams for download and updates the table on screen
+        self.download_queue.cancel()
+        download_struc = self.download_queue.get_download_struc()
+        for position in download_struc.keys():
+            self.update_list(self.status_list_widget, download_struc[position]['status'], position)
+            self.update_list(self.progress_list_widget, download_struc[position]['progress'], position)
 
     def create_error_report_box(self):
         # Creates a window to display a report on the streams that have failed to download or convert
         if self.check_error_report_running():
             return
-        self.error_report_window = Error_Report(self.settings, error_list=self.error_list)
+        self.error_report_window = Error_Report(self.settings, error_list=self.download_queue.get_errors())
         self.error_report_window.mainloop()
         
-    def update_list(self, list_widget, message, position = None):
+    def update_list(self, list_widget, message, position):
         # Updates a cell contents in the table
-        if not position:
-            position = self.download_struc_pointer
         list_widget.delete(position)
         list_widget.insert(position, message)
 
@@ -1005,15 +1121,12 @@ class Download_Streams(Screen):
         except TclError:
             return False
 
-    def wait_to_kill(self):
-        # waits for the download/convert to finish before the window is killed
-        if not self.is_download_running():
-            if self.check_error_report_running():
-                self.error_report_window.kill_window()
-            self.kill_window()
-            self.next_window = 'download_input'
-        else:
-            self.after(100, self.wait_to_kill)
+    def close_after_cancel(self):
+        # kill the window once the workers have stopped after the downloads were cancelled
+        if self.check_error_report_running():
+            self.error_report_window.kill_window()
+        self.kill_window()
+        self.next_window = 'download_input'
 
     def previous_pressed(self):
         # Returns back to the input screen and kills the download thread if needed
@@ -1023,10 +1136,9 @@ class Download_Streams(Screen):
             self.kill_window()
             self.next_window = 'download_input'
         else:
-            self.force_stop_download = True
+            # the window is closed when the workers post that they have stopped
             self.deactivate_previous_button()
             self.cancel_all_downloads()
-            self.after(0, self.wait_to_kill)
 
     def done_pressed(self):
         # Returns to youtube_downloader menu
@@ -1043,23 +1155,25 @@ class Error_Report(Screen):
 
     def configure_window(self):
         self.master.title("Error Report")
-        self.master.geometry("595x400")
+        self.master.geometry("871x400")
         self.master.resizable(0,0)
         
     def create_widgets(self):
-        Label(self.master, borderwidth=1, text='Error Report',font=('times',15,'bold')).place(x=230, y=5)
+        Label(self.master, borderwidth=1, text='Error Report',font=('times',15,'bold')).place(x=368, y=5)
         self.create_report_table()
         # button to close window
-        Button(self.master, width= 10,font=('times',15,'bold'), text='Done', command=self.done_pressed).place(x=220, y=350)
+        Button(self.master, width= 10,font=('times',15,'bold'), text='Done', command=self.done_pressed).place(x=358, y=350)
 
     def create_report_table(self):
         # create a table to display the error report
         self.scrollbar_widget_y=Scrollbar(self.master, command=self.track_scrollbar_for_table_y)
-        self.scrollbar_widget_y.place(x=563,y=50,height=275)
+        self.scrollbar_widget_y.place(x=839,y=50,height=275)
         self.scrollbar_widget_x_name=Scrollbar(self.master, orient=HORIZONTAL,command=self.track_scrollbar_x_name)
         self.scrollbar_widget_x_name.place(x=10,y=323, width=276)
         self.scrollbar_widget_x_error=Scrollbar(self.master, orient=HORIZONTAL,command=self.track_scrollbar_x_error)
         self.scrollbar_widget_x_error.place(x=286, y=323, width=277)
+        self.scrollbar_widget_x_metrics=Scrollbar(self.master, orient=HORIZONTAL,command=self.track_scrollbar_x_metrics)
+        self.scrollbar_widget_x_metrics.place(x=562, y=323, width=277)
         Label(self.master, borderwidth=1, relief=GROOVE,text='Name',font=('times',10,'bold'),width=39).place(x=10,y=34)
         self.name_list_widget = Listbox(self.master,
                                          highlightthickness=0,
@@ -1078,9 +1192,19 @@ class Error_Report(Screen):
                                          width=46,
                                          height=17)
         self.error_list_widget.place(x=285,y=50)
+        Label(self.master, borderwidth=1, relief=GROOVE,text='Timings',font=('times',10,'bold'),width=40).place(x=561,y=34)
+        self.metrics_list_widget = Listbox(self.master,
+                                           highlightthickness=0,
+                                           yscrollcommand=self.scrollbar_widget_y.set,
+                                           xscrollcommand=self.scrollbar_widget_x_metrics.set,
+                                           exportselection=False,
+                                           width=46,
+                                           height=17)
+        self.metrics_list_widget.place(x=561,y=50)
         self.table_column_widgets = [self.name_list_widget,
-                                     self.error_list_widget]
-        Label(self.master, borderwidth=1, relief=GROOVE,width=2).place(x=563,y=34)
+                                     self.error_list_widget,
+                                     self.metrics_list_widget]
+        Label(self.master, borderwidth=1, relief=GROOVE,width=2).place(x=839,y=34)
         self.add_errors()
 
     def prepare_window(self):
@@ -1094,11 +1218,16 @@ class Error_Report(Screen):
         # Move side to side in the name error box via a scroll bar
         self.error_list_widget.xview(*args)
 
+    def track_scrollbar_x_metrics(self,*args):
+        # Move side to side in the timings list box via a scroll bar
+        self.metrics_list_widget.xview(*args)
+
     def add_errors(self):
         # Add error meta to table
         for error in self.error_list:
             self.name_list_widget.insert(END, error["name"])
             self.error_list_widget.insert(END, error["error"])
+            self.metrics_list_widget.insert(END, error["metrics"].get_summary())
 
     def done_pressed(self):
         # Close window
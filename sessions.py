@@ -0,0 +1,75 @@
+import threading
+import json
+import os
+
+def load_session_file(file_path):
+    # returns the list of stream meta stored in a session file. Both session journals and the
+    # older '.json' session files which hold a single list are supported
+    with open(file_path, 'r') as session_file:
+        if file_path.endswith('.json'):
+            return json.load(session_file)
+        entries = []
+        for line in session_file:
+            if line.strip():
+                replay_record(entries, json.loads(line))
+        return entries
+
+def replay_record(entries, record):
+    # apply a single journal record to a list of stream meta, unknown records are ignored
+    if record.get("op") == "add":
+        entries.append(record["meta"])
+    elif record.get("op") == "delete":
+        del entries[record["position"]]
+    elif record.get("op") == "clear":
+        del entries[:]
+
+class Session_Journal():
+    """ Stores a session as an append-only journal of add, delete and clear records, one JSON object
+        per line, so each change to the download list only writes the change itself. The journal is
+        compacted to just the current entries once it holds too many stale records """
+    def __init__(self, file_path, compact_threshold=100):
+        self.file_path = file_path
+        self.compact_threshold = compact_threshold
+        self.entries = []
+        self.record_count = 0
+        self.lock = threading.Lock()
+
+    def add(self, url, chosen_format, start_time, end_time):
+        # add the meta of a stream to the end of the session
+        meta = {"url": url,
+                "chosen_format": chosen_format,
+                "start_time": str(start_time),
+                "end_time": str(end_time)}
+        self.append_record({"op": "add", "meta": meta})
+
+    def delete(self, position):
+        # remove the stream at the given position from the session
+        self.append_record({"op": "delete", "position": position})
+
+    def clear(self):
+        # remove every stream from the session
+        self.append_record({"op": "clear"})
+
+    def append_record(self, record):
+        # apply the record and write it to the end of the journal
+        with self.lock:
+            replay_record(self.entries, record)
+            self.record_count += 1
+            if self.is_compaction_due():
+                self.compact()
+                return
+            with open(self.file_path, 'a') as session_file:
+                session_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def is_compaction_due(self):
+        # checks if the journal holds more stale records than the compaction threshold
+        return self.record_count - len(self.entries) > self.compact_threshold
+
+    def compact(self):
+        # rewrite the journal as one add record per current entry, the file is replaced atomically
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as session_file:
+            for meta in self.entries:
+                session_file.write(json.dumps({"op": "add", "meta": meta}, sort_keys=True) + '\n')
+        os.replace(temp_path, self.file_path)
+        self.record_count = len(self.entries)
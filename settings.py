@@ -1,4 +1,6 @@
 import configparser
+import os
+from bandwidth import parse_rate, parse_schedule
 
 class Settings_Parser():
     """ Settings parser which will read and write to the configuration file """
@@ -20,6 +22,36 @@ class Settings_Parser():
         self.audio_only_formats = self.config_file_parser["FORMAT"]["supported_audio_only_formats"].split(",")
         self.video_only_formats = self.config_file_parser["FORMAT"]["supported_video_only_formats"].split(",")
         self.audio_and_video_formats = self.config_file_parser["FORMAT"]["supported_audio_and_video_formats"].split(",")
+        self.download_workers = self.config_file_parser.getint("DOWNLOAD", "download_workers", fallback=3)
+        self.convert_workers = self.config_file_parser.getint("DOWNLOAD", "convert_workers", fallback=0)
+        self.resolve_workers = self.config_file_parser.getint("DOWNLOAD", "resolve_workers", fallback=8)
+        self.download_segments = self.config_file_parser.getint("DOWNLOAD", "download_segments", fallback=4)
+        self.partial_fetch = self.config_file_parser.getboolean("DOWNLOAD", "partial_fetch", fallback=True)
+        self.partial_fetch_margin = self.config_file_parser.getint("DOWNLOAD", "partial_fetch_margin", fallback=5)
+        self.exact_trim = self.config_file_parser.getboolean("CONVERT", "exact_trim", fallback=False)
+        self.convert_niceness = self.config_file_parser.getint("CONVERT", "niceness", fallback=0)
+        self.pipe_convert_formats = [f for f in self.config_file_parser.get("CONVERT", "pipe_convert_formats",
+                                                                            fallback="webm,flv").split(",") if f]
+        self.metadata_cache_file = self.config_file_parser.get("CACHE", "metadata_file", fallback="cache/metadata.json")
+        self.metadata_cache_ttl = self.config_file_parser.getint("CACHE", "metadata_ttl", fallback=604800)
+        self.metadata_cache_size = self.config_file_parser.getint("CACHE", "metadata_max_entries", fallback=5000)
+        self.output_cache_directory = self.config_file_parser.get("CACHE", "output_directory", fallback="cache/outputs")
+        self.output_cache_size = self.config_file_parser.getint("CACHE", "output_max_size", fallback=2048)
+        self.max_rate = parse_rate(self.config_file_parser.get("BANDWIDTH", "max_rate", fallback="0"))
+        self.max_stream_rate = parse_rate(self.config_file_parser.get("BANDWIDTH", "max_stream_rate", fallback="0"))
+        self.bandwidth_schedule = parse_schedule(self.config_file_parser.get("BANDWIDTH", "schedule", fallback=""))
+        self.retry_max_attempts = self.config_file_parser.getint("RETRY", "max_attempts", fallback=5)
+        self.retry_base_delay = self.config_file_parser.getfloat("RETRY", "base_delay", fallback=1.0)
+        self.retry_max_delay = self.config_file_parser.getfloat("RETRY", "max_delay", fallback=60.0)
+        self.retry_max_url_refreshes = self.config_file_parser.getint("RETRY", "max_url_refreshes", fallback=2)
+        self.write_metrics = self.config_file_parser.getboolean("METRICS", "write_metrics", fallback=True)
+        self.prometheus_file = self.config_file_parser.get("METRICS", "prometheus_file", fallback="")
+        self.max_video_height = self.config_file_parser.getint("VIDEO", "max_height", fallback=1080)
+        self.max_video_bitrate = self.config_file_parser.getint("VIDEO", "max_bitrate", fallback=0)
+        self.service_host = self.config_file_parser.get("SERVICE", "host", fallback="127.0.0.1")
+        self.service_port = self.config_file_parser.getint("SERVICE", "port", fallback=8765)
+        self.service_jobs_file = self.config_file_parser.get("SERVICE", "jobs_file", fallback="cache/jobs.jsonl")
+        self.service_max_finished_jobs = self.config_file_parser.getint("SERVICE", "max_finished_jobs", fallback=1000)
 
     def set_defaults(self):
         # set any default settings for the program
@@ -84,3 +116,122 @@ class Settings_Parser():
     def get_download_directory(self):
         # returns the download directory path
         return self.download_directory
+
+    def get_download_workers(self):
+        # returns the number of streams to download at the same time
+        return max(1, self.download_workers)
+
+    def get_convert_workers(self):
+        # returns the number of ffmpeg conversions to run at the same time, 0 uses one per CPU
+        if self.convert_workers > 0:
+            return self.convert_workers
+        return os.cpu_count() or 1
+
+    def get_resolve_workers(self):
+        # returns the number of URLs to look up at the same time when loading a session
+        return max(1, self.resolve_workers)
+
+    def get_download_segments(self):
+        # returns the number of connections used to download a single large stream
+        return max(1, self.download_segments)
+
+    def get_partial_fetch_margin(self):
+        # returns the number of seconds downloaded either side of a trimmed clip, or None when
+        # trimmed streams should be downloaded in full
+        if not self.partial_fetch:
+            return None
+        return self.partial_fetch_margin
+
+    def get_exact_trim(self):
+        # returns whether trimmed streams are re-encoded from the start of the file to cut at the exact times
+        return self.exact_trim
+
+    def get_pipe_convert_formats(self):
+        # returns the stream formats that are piped into ffmpeg while downloading instead of using a temporary file
+        return self.pipe_convert_formats
+
+    def get_convert_niceness(self):
+        # returns the niceness ffmpeg is started with, higher values give conversions a lower priority
+        return self.convert_niceness
+
+    def get_metadata_cache_file(self):
+        # returns the path of the video metadata cache file
+        return self.metadata_cache_file
+
+    def get_metadata_cache_ttl(self):
+        # returns the number of seconds video meta is kept in the cache
+        return self.metadata_cache_ttl
+
+    def get_metadata_cache_size(self):
+        # returns the maximum number of videos kept in the metadata cache
+        return self.metadata_cache_size
+
+    def get_output_cache_directory(self):
+        # returns the directory finished downloads are cached in
+        return self.output_cache_directory
+
+    def get_output_cache_size(self):
+        # returns the maximum size in bytes of the output cache, 0 turns the cache off
+        return max(0, self.output_cache_size) * 1024 * 1024
+
+    def get_max_rate(self):
+        # returns the combined download rate of all streams in bytes per second, 0 is unlimited
+        return self.max_rate
+
+    def get_max_stream_rate(self):
+        # returns the download rate of a single stream in bytes per second, 0 is unlimited
+        return self.max_stream_rate
+
+    def get_bandwidth_schedule(self):
+        # returns the periods of the day that replace the combined download rate as
+        # (start minute, end minute, rate) tuples
+        return self.bandwidth_schedule
+
+    def get_retry_max_attempts(self):
+        # returns the maximum number of times a stream is attempted before it is reported as failed
+        return max(1, self.retry_max_attempts)
+
+    def get_retry_base_delay(self):
+        # returns the longest wait in seconds before the first retry, doubled for every later retry
+        return self.retry_base_delay
+
+    def get_retry_max_delay(self):
+        # returns the longest wait in seconds between attempts, unless the server asks for longer
+        return self.retry_max_delay
+
+    def get_retry_max_url_refreshes(self):
+        # returns the number of times a stream is looked up again after its download URL expired
+        return self.retry_max_url_refreshes
+
+    def get_write_metrics(self):
+        # returns whether the timings of every stream are written to a metrics file next to the session
+        return self.write_metrics
+
+    def get_prometheus_file(self):
+        # returns the path of the Prometheus text file the batch totals are written to, or None
+        return self.prometheus_file or None
+
+    def get_max_video_height(self):
+        # returns the tallest video only stream that is downloaded in pixels, 0 is unlimited
+        return max(0, self.max_video_height)
+
+    def get_max_video_bitrate(self):
+        # returns the highest bitrate of a video only stream that is downloaded in bits per second,
+        # 0 is unlimited
+        return max(0, self.max_video_bitrate) * 1000
+
+    def get_service_host(self):
+        # returns the address the download service listens on
+        return self.service_host
+
+    def get_service_port(self):
+        # returns the port the download service listens on
+        return self.service_port
+
+    def get_service_jobs_file(self):
+        # returns the path of the journal the download service keeps its jobs in
+        return self.service_jobs_file
+
+    def get_service_max_finished_jobs(self):
+        # returns the number of finished jobs the download service keeps, 0 keeps every job
+        return self.service_max_finished_jobs
@@ -8,7 +8,8 @@ build_dir =
 data_files = [('',['settings.ini',
                    'LICENSE',
                    'README.md']),
-              ('sessions',[])]
+              ('sessions',[]),
+              ('cache',[])]
 
 options = {'py2exe': {
                       'dist_dir': build_dir}}
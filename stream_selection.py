@@ -0,0 +1,155 @@
+import collections
+
+# codecs youtube uses for each kind of stream, pafy only reports the media type and extension
+STREAM_CODECS = {("normal", "mp4"): ("h264", "aac"),
+                 ("normal", "webm"): ("vp8", "vorbis"),
+                 ("normal", "flv"): ("h264", "aac"),
+                 ("normal", "3gp"): ("mp4v", "aac"),
+                 ("audio", "m4a"): ("aac",),
+                 ("audio", "webm"): ("opus",),
+                 ("audio", "ogg"): ("vorbis",),
+                 ("video", "m4v"): ("h264",),
+                 ("video", "webm"): ("vp9",)}
+
+# codecs each format can hold, a stream whose codecs all fit is remuxed instead of transcoded
+FORMAT_CODECS = {"mp3": ("mp3",),
+                 "ogg": ("vorbis", "opus"),
+                 "m4a": ("aac",),
+                 "m4v": ("h264",),
+                 "webm": ("vp8", "vp9", "vorbis", "opus"),
+                 "mp4": ("h264", "mp4v", "aac"),
+                 "flv": ("h264", "aac"),
+                 "3gp": ("h264", "mp4v", "aac"),
+                 "avi": ("h264", "mp4v", "mp3")}
+
+# the work ffmpeg does for each kind of conversion, counted as a share of the stream's size
+CONVERSION_WEIGHTS = {'none': 0.0, 'remux': 0.05, 'transcode': 1.0}
+
+# the media types a stream may be chosen from for each format type, in order of preference
+FORMAT_TYPE_MEDIATYPES = {'a': ("audio", "normal"),
+                          'av': ("normal",),
+                          'v': ("video", "normal")}
+
+# streams with at least this share of the best quality available are all considered, the cheapest
+# is chosen. Lets a slightly lower bitrate in a codec that needs no conversion win
+QUALITY_TOLERANCE = 0.75
+
+# bits per pixel per second used to estimate the size of a video stream whose size is unknown,
+# about 0.1 bits per pixel at 30 frames a second
+VIDEO_BITS_PER_PIXEL = 3
+# bits per second assumed for the audio of a muxed stream whose size is unknown
+AUDIO_BITRATE = 128000
+
+def get_conversion(mediatype, extension, chosen_format):
+    # returns 'none' if the stream is already in the chosen format, 'remux' if its codecs can be
+    # copied into the chosen format as they are and 'transcode' if ffmpeg has to re-encode it
+    if extension == chosen_format:
+        return 'none'
+    codecs = STREAM_CODECS.get((mediatype, extension))
+    if codecs and all(codec in FORMAT_CODECS.get(chosen_format, ()) for codec in codecs):
+        return 'remux'
+    return 'transcode'
+
+class Stream_Choice():
+    """ A stream chosen for a format with the conversion it needs, the number of bytes expected to
+        be downloaded and its total cost """
+    def __init__(self, stream, conversion, size, size_known, cost):
+        self.stream = stream
+        self.conversion = conversion
+        self.size = size
+        self.size_known = size_known
+        self.cost = cost
+
+class Stream_Index():
+    """ Indexes the streams of a video once by media type, extension, codecs, quality and size. A
+        stream is chosen for a format by the lowest cost, the bytes to download plus the work ffmpeg
+        has to do to convert them, among the streams close to the best quality available """
+    def __init__(self, streams, duration):
+        # duration of the video in seconds, used to estimate sizes the backend didn't supply
+        self.duration = duration
+        self.entries = collections.defaultdict(list)
+        for stream in streams:
+            self.entries[stream.mediatype].append(self.index_stream(stream))
+
+    def index_stream(self, stream):
+        # returns the index entry of a stream
+        size, size_known = self.get_size(stream)
+        return {"stream": stream,
+                "mediatype": stream.mediatype,
+                "extension": stream.extension,
+                "codecs": STREAM_CODECS.get((stream.mediatype, stream.extension), ()),
+                "bitrate": getattr(stream, "rawbitrate", None) or 0,
+                "quality": self.get_quality(stream),
+                "size": size,
+                "size_known": size_known}
+
+    def get_size(self, stream):
+        # returns the size of a stream in bytes and whether it is known or estimated. The size is
+        # only known without a request when the backend supplied it, pafy's get_filesize would
+        # make a request for every stream
+        size = getattr(stream, "_fsize", None) or getattr(stream, "size", None)
+        if size:
+            return size, True
+        bitrate = getattr(stream, "rawbitrate", None) or 0
+        if not bitrate:
+            width, height = self.get_dimensions(stream)
+            bitrate = width * height * VIDEO_BITS_PER_PIXEL
+            if stream.mediatype == "normal":
+                bitrate += AUDIO_BITRATE
+        return int(bitrate * self.duration / 8), False
+
+    def get_dimensions(self, stream):
+        # returns the width and height of a stream, 0 for audio streams
+        try:
+            width, height = stream.resolution.split(" ")[0].split("x")
+            return int(width), int(height)
+        except (AttributeError, ValueError):
+            return 0, 0
+
+    def get_quality(self, stream):
+        # returns a number to compare the quality of streams of the same media type, the bitrate of
+        # audio streams and the height of video streams
+        if stream.mediatype == "audio":
+            return getattr(stream, "rawbitrate", None) or 0
+        return self.get_dimensions(stream)[1]
+
+    def get_candidates(self, mediatype, max_height=0, max_bitrate=0):
+        # returns the entries of a media type that are close to the best quality, 3D streams are
+        # only used when there is nothing else. Video only streams over the height or bitrate
+        # limits are left out unless every one of them is over
+        entries = [entry for entry in self.entries[mediatype] if "3D" not in (entry["stream"].resolution or "")]
+        entries = entries or self.entries[mediatype]
+        if not entries:
+            return []
+        if mediatype == "video":
+            limited = [entry for entry in entries if self.is_within_limits(entry, max_height, max_bitrate)]
+            lowest = min(entry["quality"] for entry in entries)
+            entries = limited or [entry for entry in entries if entry["quality"] == lowest]
+        best = max(entry["quality"] for entry in entries)
+        return [entry for entry in entries if entry["quality"] >= best * QUALITY_TOLERANCE]
+
+    def is_within_limits(self, entry, max_height, max_bitrate):
+        # checks if a stream is no taller and has no higher bitrate than the limits, 0 is unlimited
+        if max_height and entry["quality"] > max_height:
+            return False
+        if max_bitrate and entry["bitrate"] > max_bitrate:
+            return False
+        return True
+
+    def get_cost(self, entry, conversion):
+        # returns the cost of downloading a stream and converting it
+        return entry["size"] * (1 + CONVERSION_WEIGHTS[conversion])
+
+    def choose(self, chosen_format, format_type, max_height=0, max_bitrate=0):
+        # returns the Stream_Choice with the lowest cost for the chosen format, or None if the video
+        # has no stream of a suitable media type. The height and bitrate limit video only streams
+        for mediatype in FORMAT_TYPE_MEDIATYPES.get(format_type, ("normal",)):
+            choices = []
+            for entry in self.get_candidates(mediatype, max_height, max_bitrate):
+                conversion = get_conversion(mediatype, entry["extension"], chosen_format)
+                choices.append(Stream_Choice(entry["stream"], conversion, entry["size"],
+                                             entry["size_known"], self.get_cost(entry, conversion)))
+            if choices:
+                # the higher quality stream wins a tie
+                return min(choices, key=lambda choice: (choice.cost, -self.get_quality(choice.stream)))
+        return None
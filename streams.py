@@ -1,10 +1,22 @@
+import urllib.error
 import pafy
 import datetime
+import time
 import os
+from metadata_cache import Cached_Stream
+from file_names import File_Names
+from stream_selection import Stream_Index
+
+class Video_Unavailable(ValueError):
+    """ Raised when a video that was found before can't be looked up again, i.e. it has been removed
+        or made private. A ValueError like pafy's error for a video that doesn't exist, so the
+        download isn't retried """
+    pass
 
 class Stream_Generator():
     def __init__(self, url, start_time, end_time, format_type,
-                 chosen_format, top_dir):
+                 chosen_format, top_dir, metadata_cache=None, file_names=None, max_video_height=0,
+                 max_video_bitrate=0):
         self.url = url
         self.start_time = start_time
         self.end_time = end_time
@@ -13,6 +25,7 @@ class Stream_Generator():
         self.title = None
         self.duration = None
         self.stream = None
+        self.stream_choice = None # the chosen stream with its conversion, estimated size and cost
         self.vid = None
         self.chosen_format = chosen_format
         self.sub_format = None
@@ -20,7 +33,16 @@ class Stream_Generator():
         self.file_path = None # final path to download stream to
         self.temp_file_path = None # temporary file path for convertion/trimming
         self.top_dir = top_dir
+        self.metadata_cache = metadata_cache
+        # reserves the file paths of every stream in the batch, shared so streams never share a path
+        self.file_names = file_names or File_Names()
+        # limits on the height and bits per second of a video only stream, 0 is unlimited
+        self.max_video_height = max_video_height
+        self.max_video_bitrate = max_video_bitrate
         self.error_messages = None
+        self.generated = False
+        self.clip_offset = 0 # time in seconds the downloaded file starts at when only part was downloaded
+        self.resolve_time = 0 # time in seconds spent looking the video up with pafy
         self.disallowed_characters = ['~', '#', '%', '*', '{', '}', '\\',
                                       ':', '<', '>', '?', '/', '+', '|', '"']
 
@@ -37,12 +59,17 @@ class Stream_Generator():
             return
         self.set_title()
         self.set_file_path()
+        self.generated = True
 
     def set_url(self):
-        # create a new pafy object from url
+        # create a new pafy object from url, the metadata cache is used instead when it holds the video
+        if self.metadata_cache:
+            self.vid = self.metadata_cache.get(self.url)
+            if self.vid:
+                return
         try:
             #logger.log_debug('Checking if URL exists \'%s\'' % url)
-            self.vid = pafy.new(self.url)
+            self.fetch_video()
             #logger.log_debug('URL found.')
         except (IOError, ValueError): # Catches the exception if the URL wasn't found
             self.error_messages = ('URL not found: %s' %self.url)
@@ -53,6 +80,58 @@ class Stream_Generator():
             print(e)
             #logger.log_debug('URL not found. Exception: %s' % e)
 
+    def fetch_video(self):
+        # look up the video with pafy and keep its meta in the metadata cache
+        started = time.time()
+        try:
+            self.vid = pafy.new(self.url)
+        finally:
+            self.resolve_time += time.time() - started
+        if self.metadata_cache:
+            self.metadata_cache.store(self.vid)
+
+    def refresh_stream(self, force=False):
+        # a stream selected from the metadata cache has no download URL, look the video up again
+        # and swap in the matching pafy stream. Must be called before the stream is downloaded.
+        # force will also refresh a pafy stream, i.e. when its signed URL may have expired
+        if not force and not isinstance(self.stream, Cached_Stream):
+            return
+        old_stream = self.stream
+        try:
+            self.fetch_video()
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            # the network failed rather than the video, worth trying again
+            raise
+        except (IOError, ValueError) as error:
+            raise Video_Unavailable("The video is no longer available for URL: %s (%s)"
+                                    %(self.url, error)) from error
+        for s in self.get_allstreamlist():
+            if (s.extension == old_stream.extension and s.mediatype == old_stream.mediatype
+                    and s.resolution == old_stream.resolution and s.bitrate == old_stream.bitrate):
+                self.stream = s
+                return
+        # the exact stream has gone, take the best stream of the same kind instead
+        if old_stream.mediatype == "audio":
+            self.stream = self.get_bestaudio(old_stream.extension)
+        elif old_stream.mediatype == "video":
+            self.stream = self.choose_video(old_stream.extension)
+        else:
+            self.stream = self.get_bestnormal(old_stream.extension)
+        if not self.stream:
+            raise IOError("The %s stream is no longer available for URL: %s"
+                          %(old_stream.extension, self.url))
+
+    def choose_video(self, extension):
+        # returns the cheapest video only stream of the extension within the height and bitrate
+        # limits, or None
+        streams = [s for s in self.get_allstreamlist() if s.mediatype == "video" and s.extension == extension]
+        choice = Stream_Index(streams, self.get_duration_seconds()).choose(
+            self.chosen_format, 'v', self.max_video_height, self.max_video_bitrate)
+        if choice is None:
+            return None
+        self.stream_choice = choice
+        return choice.stream
+
     def set_title(self):
         # parse the title of the stream so that it is allowed to be used as a filename
         title = self.stream.title
@@ -65,24 +144,23 @@ class Stream_Generator():
     def set_file_path(self):
         # builds a file path for the stream to be downloaded to and builds a temporary
         # path if a conversion is required or the stream needs to be trimmed. duplicate
-        # filenames are checked and handled here.
-        file_path = os.path.join(self.top_dir, self.title)
-        # add ' - Copy' to the filename until its unique
-        while os.path.isfile(file_path + "." + self.chosen_format):
-            file_path += " - Copy"
+        # filenames are handled by reserving both paths in the batch's file name index,
+        # any paths reserved before are given up first.
+        self.release_file_path()
         if self.is_convert_required():
-            temp_file_path = file_path + '_TEMP'
-            # add '_TEMP' to the temporary file filename until its unique
-            while os.path.isfile(temp_file_path + '.' + self.sub_format):
-                temp_file_path += '_TEMP'
-            self.temp_file_path = temp_file_path + '.' + self.sub_format
+            temp_format = self.sub_format
         elif self.is_trimmed():
-            temp_file_path = file_path + '_TEMP'
-            # add '_TEMP' to the temporary file filename until its unique
-            while os.path.isfile(temp_file_path + '.' + self.chosen_format):
-                temp_file_path += '_TEMP'
-            self.temp_file_path = temp_file_path + '.' + self.chosen_format
-        self.file_path = file_path + '.' + self.chosen_format
+            temp_format = self.chosen_format
+        else:
+            temp_format = None
+        self.file_path, self.temp_file_path = self.file_names.reserve(os.path.join(self.top_dir, self.title),
+                                                                      self.chosen_format, temp_format)
+
+    def release_file_path(self):
+        # give up the reserved paths of the stream, i.e. when it is removed from the download list
+        self.file_names.release(self.file_path, self.temp_file_path)
+        self.file_path = None
+        self.temp_file_path = None
 
     def set_time(self):
         # carry's out various checks and sets the start and end time
@@ -126,22 +204,18 @@ class Stream_Generator():
         self.duration = duration
 
     def set_media_format(self):
-        # cycle through all streams available to check if the user defined file format is supported
-        for s in self.get_allstreamlist():
-            if s.extension == self.chosen_format and s.mediatype == "normal":
-                self.stream = self.get_bestnormal(self.chosen_format)
-                return
-            if s.extension == self.chosen_format and s.mediatype == "audio":
-                self.stream = self.get_bestaudio(self.chosen_format)
-                return
-        # if the chosen file format is not in the stream list, get the best quality stream of
-        # the same format type as a substitution for now
-        if self.format_type == 'av':
-            self.stream = self.get_bestnormal()
-        elif self.format_type == 'a':
-            self.stream = self.get_bestaudio()
-        # get the format of the stream generated
-        self.sub_format = self.stream.extension
+        # choose the stream that is cheapest to download and convert to the chosen format, a stream
+        # already in the chosen format needs no conversion and is usually chosen
+        index = Stream_Index(self.get_allstreamlist(), self.get_duration_seconds())
+        self.stream_choice = index.choose(self.chosen_format, self.format_type, self.max_video_height,
+                                          self.max_video_bitrate)
+        if self.stream_choice is None:
+            self.error_messages = ("No %s stream is available for URL: \'%s\'" %(self.chosen_format, self.url))
+            return
+        self.stream = self.stream_choice.stream
+        # get the format of the stream generated when it has to be converted
+        if self.stream.extension != self.chosen_format:
+            self.sub_format = self.stream.extension
 
     def update_properties(self):
         # update stream attributes to account for internal/environment changes
@@ -155,6 +229,25 @@ class Stream_Generator():
         else:
             return False
 
+    def is_remux_possible(self):
+        # check if the stream's codecs can be copied into the chosen format without re-encoding
+        return self.stream_choice is not None and self.stream_choice.conversion == 'remux'
+
+    def is_video(self):
+        # check if the chosen format holds video
+        return self.format_type in ('av', 'v')
+
+    def get_video_quality(self):
+        # returns the resolution and bitrate of a video only stream, which the video limits decide,
+        # or an empty string for any other stream
+        if self.stream is None or self.stream.mediatype != "video":
+            return ''
+        return "%s@%s" %(self.stream.resolution, getattr(self.stream, "rawbitrate", None) or 0)
+
+    def is_generated(self):
+        # check if the stream has been successfully built by generate
+        return self.generated
+
     def is_start_time_set(self):
         # check if user has defined the start_time
         return self.start_time_set
@@ -181,6 +274,10 @@ class Stream_Generator():
         # return video title
         return self.title
 
+    def get_video_id(self):
+        # returns the youtube ID of the video
+        return self.vid.videoid
+
     def get_url(self):
         # return youtube URL
         return self.url
@@ -205,10 +302,45 @@ class Stream_Generator():
         # returns the temporary file path for use with convertion and trimming
         return self.temp_file_path
 
+    def set_clip_offset(self, clip_offset):
+        # record the time the downloaded file starts at, 0 unless only part of the stream was downloaded
+        self.clip_offset = clip_offset
+
+    def get_clip_offset(self):
+        # returns the time in seconds the downloaded file starts at
+        return self.clip_offset
+
+    def get_resolve_time(self):
+        # returns the time in seconds spent looking the video up, including any refreshes
+        return self.resolve_time
+
+    def get_start_seconds(self):
+        # returns the start time in seconds
+        return self.start_time.hour*3600 + self.start_time.minute*60 + self.start_time.second
+
+    def get_end_seconds(self):
+        # returns the end time in seconds
+        return self.end_time.hour*3600 + self.end_time.minute*60 + self.end_time.second
+
+    def get_stream_id(self):
+        # returns a string which identifies the selected stream of the video, used to check that
+        # a partial download belongs to this stream
+        return "%s-%s-%s-%s-%s" %(self.vid.videoid, self.stream.mediatype, self.stream.extension,
+                                  self.stream.resolution, self.stream.bitrate)
+
     def get_duration(self):
         # return video duration in its standard form
         return self.vid.duration
 
+    def get_duration_seconds(self):
+        # returns the video duration in seconds
+        return self.duration.hour*3600 + self.duration.minute*60 + self.duration.second
+
+    def get_estimated_size(self):
+        # returns the number of bytes the chosen stream is expected to download and whether the
+        # size is known or estimated from its bitrate or resolution
+        return self.stream_choice.size, self.stream_choice.size_known
+
     def get_published(self):
         # return video publish date
         return self.vid.published
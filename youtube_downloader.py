@@ -1,6 +1,9 @@
 from tkinter import Tk
 import os
 from settings import Settings_Parser
+from metadata_cache import Metadata_Cache
+from output_cache import Output_Cache
+from file_names import File_Names
 import screens
 
 SETTINGS_FILE = os.getcwd() + "/settings.ini"
@@ -10,7 +13,15 @@ class App():
         # start at the 'main_menu' screen
         self.next_window = 'main_menu'
         self.download_list = []
+        self.session_file = None
+        # reserves the file paths of the streams in the download list
+        self.file_names = File_Names()
         self.settings = Settings_Parser(SETTINGS_FILE)
+        self.metadata_cache = Metadata_Cache(self.settings.get_metadata_cache_file(),
+                                             self.settings.get_metadata_cache_ttl(),
+                                             self.settings.get_metadata_cache_size())
+        self.output_cache = Output_Cache(self.settings.get_output_cache_directory(),
+                                         self.settings.get_output_cache_size())
 
     def run(self):
         # the main loop for the program, when the loop breaks the
@@ -28,6 +39,8 @@ class App():
             else:
                 # will exit the main loop
                 program_finished=True
+        # keep any video meta looked up during this run for the next one
+        self.metadata_cache.save()
                 
     # all the methods below are responsible for setting up and 
     # configuring individual screens.
@@ -43,24 +56,29 @@ class App():
         # Runs the download list input screen
         self.next_window = None
         download_input = screens.Download_Input_Screen(self.settings,
-                                                       download_list=self.download_list)
+                                                       download_list=self.download_list,
+                                                       metadata_cache=self.metadata_cache,
+                                                       file_names=self.file_names)
         download_input.mainloop()
         self.check_next_window(download_input)
         # get list of streams to download if the next screen isn't the main menu
         if self.next_window == "main_menu":
-            self.download_list = []
+            self.clear_download_list()
         else:
             self.download_list=download_input.get_download_list()
+            self.session_file=download_input.get_session_file()
 
     def run_stream_download(self, download_list):
         # Run download and monitoring screen
         self.next_window = None
-        download_stream = screens.Download_Streams(self.settings, download_list=download_list)
+        download_stream = screens.Download_Streams(self.settings, download_list=download_list,
+                                                  session_file=self.session_file,
+                                                  output_cache=self.output_cache)
         download_stream.mainloop()
         self.check_next_window(download_stream)
         # clear download list if the next window is the main menu
         if self.next_window == "main_menu":
-            self.download_list = []
+            self.clear_download_list()
 
     def run_settings_window(self):
         # Run settings window
@@ -71,6 +89,11 @@ class App():
         
     # --------end of individual screen configuration---------
 
+    def clear_download_list(self):
+        # start a new download list, the download directory is scanned again for the next one
+        self.download_list = []
+        self.file_names = File_Names()
+
     def check_next_window(self, frame):
         # will get the name of the next screen to run
         if frame.get_next_window():
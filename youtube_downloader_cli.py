@@ -0,0 +1,258 @@
+import contextlib
+import argparse
+import datetime
+import threading
+import json
+import time
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from settings import Settings_Parser
+from metadata_cache import Metadata_Cache
+from sessions import load_session_file
+from streams import Stream_Generator
+from downloads import Download_Queue
+from metrics import Metrics_Writer, get_metrics_file_path
+from output_cache import Output_Cache
+from file_names import File_Names
+from bandwidth import Bandwidth_Limiter
+from retry import Retry_Policy
+from convert_scheduler import Convert_Scheduler
+from playlists import expand_stream_meta, get_expand_error
+
+SETTINGS_FILE = os.getcwd() + "/settings.ini"
+
+class Batch_Download():
+    """ Resolves and downloads a list of stream meta without a window. The outcome of every stream is
+        collected into a report that can be written as JSON """
+    def __init__(self, settings, stream_meta_list, metadata_cache=None, workers=None,
+                 convert_workers=None, resolve_workers=None, output_cache=None, metrics_writer=None,
+                 log=None):
+        self.settings = settings
+        self.stream_meta_list = stream_meta_list
+        self.metadata_cache = metadata_cache
+        self.workers = workers or settings.get_download_workers()
+        self.convert_workers = convert_workers or settings.get_convert_workers()
+        self.resolve_workers = resolve_workers or settings.get_resolve_workers()
+        self.output_cache = output_cache
+        self.metrics_writer = metrics_writer
+        self.log = log or (lambda message: None)
+        # reserves the file paths of every stream in the batch
+        self.file_names = File_Names()
+        self.streams = []
+        self.download_queue = None
+        self.download_positions = {}
+        self.finished = threading.Event()
+
+    def run(self):
+        # resolve every stream then download the ones that resolved, returns the report
+        started = time.time()
+        self.expand_playlists()
+        self.resolve_streams()
+        downloadable = [stream for stream in self.streams if not stream.get_errors()]
+        self.download_streams(downloadable)
+        return self.build_report(started, time.time())
+
+    def expand_playlists(self):
+        # replace every playlist and channel entry with an entry for each of its videos, the
+        # playlists are looked up concurrently
+        with ThreadPoolExecutor(max_workers=self.resolve_workers) as executor:
+            expanded = list(executor.map(self.expand_playlist, self.stream_meta_list))
+        self.stream_meta_list = [stream_meta for items in expanded for stream_meta in items]
+
+    def expand_playlist(self, stream_meta):
+        # returns the entries of every video in a playlist entry, runs in a worker thread. A playlist
+        # that can't be found is kept as it is so it is reported as failing its lookup
+        try:
+            return expand_stream_meta(stream_meta)
+        except Exception as error:
+            self.log(get_expand_error(stream_meta["url"], error))
+            return [stream_meta]
+
+    def resolve_streams(self):
+        # build and resolve a stream for each entry, the lookups run concurrently
+        self.streams = [self.build_stream(stream_meta) for stream_meta in self.stream_meta_list]
+        with ThreadPoolExecutor(max_workers=self.resolve_workers) as executor:
+            for stream in executor.map(self.resolve_stream, self.streams):
+                if stream.get_errors():
+                    self.log("Failed to add: %s" %stream.get_errors())
+
+    def resolve_stream(self, stream):
+        # resolve a single stream, runs in a worker thread
+        stream.generate()
+        return stream
+
+    def build_stream(self, stream_meta):
+        # creates a stream object based on some meta data, the stream is not resolved yet
+        chosen_format = stream_meta.get("chosen_format") or self.settings.get_default_file_format()
+        format_type = self.settings.get_format_type(chosen_format)
+        return Stream_Generator(stream_meta["url"], stream_meta.get("start_time") or "",
+                                stream_meta.get("end_time") or "", format_type, chosen_format,
+                                self.settings.get_download_directory(),
+                                metadata_cache=self.metadata_cache,
+                                file_names=self.file_names,
+                                max_video_height=self.settings.get_max_video_height(),
+                                max_video_bitrate=self.settings.get_max_video_bitrate())
+
+    def download_streams(self, streams):
+        # download and convert the resolved streams, blocks until every worker has stopped
+        if not streams:
+            return
+        self.download_positions = dict((id(stream), position) for position, stream in enumerate(streams))
+        self.download_queue = Download_Queue(streams,
+                                             workers=self.workers,
+                                             convert_workers=self.convert_workers,
+                                             exact_trim=self.settings.get_exact_trim(),
+                                             pipe_convert_formats=self.settings.get_pipe_convert_formats(),
+                                             segments=self.settings.get_download_segments(),
+                                             partial_fetch_margin=self.settings.get_partial_fetch_margin(),
+                                             bandwidth_limiter=Bandwidth_Limiter(self.settings.get_max_rate(),
+                                                                                 self.settings.get_max_stream_rate(),
+                                                                                 self.settings.get_bandwidth_schedule()),
+                                             retry_policy=Retry_Policy(self.settings.get_retry_max_attempts(),
+                                                                       self.settings.get_retry_base_delay(),
+                                                                       self.settings.get_retry_max_delay(),
+                                                                       self.settings.get_retry_max_url_refreshes()),
+                                             output_cache=self.output_cache,
+                                             metrics_writer=self.metrics_writer,
+                                             convert_scheduler=Convert_Scheduler(self.convert_workers,
+                                                                                 self.settings.get_convert_niceness()),
+                                             status_callback=self.download_status_changed,
+                                             finished_callback=self.finished.set)
+        self.download_queue.start()
+        try:
+            # wait with a timeout so a keyboard interrupt is handled straight away
+            while not self.finished.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            self.log("Cancelling ...")
+            self.download_queue.cancel()
+            self.finished.wait()
+
+    def download_status_changed(self, position, status):
+        # log the status of a stream whenever it changes
+        stream = self.download_queue.get_download_struc()[position]['stream']
+        self.log("%s: %s" %(stream.get_title(), status))
+
+    def build_report(self, started, finished):
+        # returns the outcome of every stream in the order they were given
+        items = [self.build_report_item(stream) for stream in self.streams]
+        return {"started": datetime.datetime.fromtimestamp(started).isoformat(),
+                "finished": datetime.datetime.fromtimestamp(finished).isoformat(),
+                "elapsed": round(finished - started, 3),
+                "total": len(items),
+                "succeeded": len([item for item in items if item["status"] == 'Done']),
+                "failed": len([item for item in items if item["status"] != 'Done']),
+                "items": items}
+
+    def build_report_item(self, stream):
+        # returns the outcome of a single stream
+        item = {"url": stream.get_url(),
+                "chosen_format": stream.get_chosen_format(),
+                "start_time": str(stream.get_start_time()),
+                "end_time": str(stream.get_end_time()),
+                "title": stream.get_title(),
+                "file_path": None,
+                "status": None,
+                "error": None,
+                "metrics": None}
+        if stream.get_errors():
+            item["status"] = 'Error during lookup'
+            item["error"] = stream.get_errors()
+            return item
+        item["estimated_size"] = stream.get_estimated_size()[0]
+        position = self.download_positions[id(stream)]
+        item["status"] = self.download_queue.get_download_struc()[position]['status']
+        item["metrics"] = self.download_queue.get_download_struc()[position]['metrics'].as_dict()
+        if item["status"] == 'Done':
+            item["file_path"] = stream.get_file_path()
+        if self.download_queue.get_error(position) is not None:
+            item["error"] = str(self.download_queue.get_error(position))
+        return item
+
+def parse_arguments(args):
+    # returns the parsed command line arguments
+    parser = argparse.ArgumentParser(description="Download YouTube videos without opening a window.")
+    parser.add_argument("inputs", nargs="+",
+                        help="session files(.json or .jsonl) and/or YouTube video, playlist or channel URLs to download")
+    parser.add_argument("-f", "--format", dest="chosen_format",
+                        help="format for URLs given on the command line, defaults to the default format in the settings")
+    parser.add_argument("-s", "--start", dest="start_time", default="",
+                        help="start time(HH:MM:SS) for URLs given on the command line")
+    parser.add_argument("-e", "--end", dest="end_time", default="",
+                        help="end time(HH:MM:SS) for URLs given on the command line")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="number of streams to download at the same time")
+    parser.add_argument("-c", "--convert-workers", type=int,
+                        help="number of ffmpeg conversions to run at the same time")
+    parser.add_argument("-r", "--resolve-workers", type=int,
+                        help="number of URLs to look up at the same time")
+    parser.add_argument("--report", default="youtube_downloader_report.json",
+                        help="path to write the JSON result report to, '-' writes it to stdout")
+    parser.add_argument("--settings", default=SETTINGS_FILE,
+                        help="path of the settings file")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="don't log the progress of each stream")
+    return parser.parse_args(args)
+
+def get_stream_meta_list(options):
+    # returns the stream meta of every session file and URL given on the command line
+    stream_meta_list = []
+    for entry in options.inputs:
+        if os.path.isfile(entry):
+            stream_meta_list.extend(load_session_file(entry))
+        else:
+            stream_meta_list.append({"url": entry,
+                                     "chosen_format": options.chosen_format,
+                                     "start_time": options.start_time,
+                                     "end_time": options.end_time})
+    return stream_meta_list
+
+def write_report(report, path):
+    # write the report as JSON to the path or to stdout
+    if path == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+def log_message(message):
+    # progress is logged to stderr so the report can be written to stdout
+    sys.stderr.write(message + '\n')
+
+def main(args=None):
+    # runs a batch download, returns 0 if every stream was downloaded and 1 otherwise
+    options = parse_arguments(args)
+    settings = Settings_Parser(options.settings)
+    metadata_cache = Metadata_Cache(settings.get_metadata_cache_file(),
+                                    settings.get_metadata_cache_ttl(),
+                                    settings.get_metadata_cache_size())
+    metrics_writer = None
+    if settings.get_write_metrics() and options.report != '-':
+        # the timings of every stream are kept next to the report
+        metrics_writer = Metrics_Writer(get_metrics_file_path(options.report),
+                                        settings.get_prometheus_file())
+    batch = Batch_Download(settings, get_stream_meta_list(options),
+                           metadata_cache=metadata_cache,
+                           workers=options.workers,
+                           convert_workers=options.convert_workers,
+                           resolve_workers=options.resolve_workers,
+                           output_cache=Output_Cache(settings.get_output_cache_directory(),
+                                                     settings.get_output_cache_size()),
+                           metrics_writer=metrics_writer,
+                           log=None if options.quiet else log_message)
+    if options.report == '-':
+        # keep stdout for the report, ffmpeg commands and other output go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            report = batch.run()
+    else:
+        report = batch.run()
+    metadata_cache.save()
+    write_report(report, options.report)
+    if report["failed"]:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
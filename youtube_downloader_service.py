@@ -0,0 +1,388 @@
+import argparse
+import threading
+import json
+import time
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from settings import Settings_Parser
+from metadata_cache import Metadata_Cache
+from streams import Stream_Generator
+from downloads import Download_Queue
+from metrics import Metrics_Writer, get_metrics_file_path
+from output_cache import Output_Cache
+from file_names import File_Names
+from bandwidth import Bandwidth_Limiter
+from retry import Retry_Policy
+from convert_scheduler import Convert_Scheduler
+from events import Event_Bus
+from jobs import Job_Store, FINISHED_STATUSES
+from playlists import is_playlist_url, expand_stream_meta, get_expand_error
+
+SETTINGS_FILE = os.getcwd() + "/settings.ini"
+
+class Download_Service():
+    """ Downloads jobs submitted by other programs for as long as it runs. Jobs are kept in a
+        journal so they survive a restart, looked up by a fixed pool of resolve workers and then
+        added to a single download queue that is kept open, so the number of threads doesn't
+        grow with the number of queued jobs """
+    def __init__(self, settings, job_store, metadata_cache=None, output_cache=None, metrics_writer=None):
+        self.settings = settings
+        self.job_store = job_store
+        self.metadata_cache = metadata_cache
+        # reserves the file paths of every job the service downloads
+        self.file_names = File_Names()
+        self.resolver = ThreadPoolExecutor(max_workers=settings.get_resolve_workers())
+        self.download_queue = Download_Queue([],
+                                             workers=settings.get_download_workers(),
+                                             convert_workers=settings.get_convert_workers(),
+                                             exact_trim=settings.get_exact_trim(),
+                                             pipe_convert_formats=settings.get_pipe_convert_formats(),
+                                             segments=settings.get_download_segments(),
+                                             partial_fetch_margin=settings.get_partial_fetch_margin(),
+                                             bandwidth_limiter=Bandwidth_Limiter(settings.get_max_rate(),
+                                                                                 settings.get_max_stream_rate(),
+                                                                                 settings.get_bandwidth_schedule()),
+                                             retry_policy=Retry_Policy(settings.get_retry_max_attempts(),
+                                                                       settings.get_retry_base_delay(),
+                                                                       settings.get_retry_max_delay(),
+                                                                       settings.get_retry_max_url_refreshes()),
+                                             output_cache=output_cache,
+                                             metrics_writer=metrics_writer,
+                                             convert_scheduler=Convert_Scheduler(settings.get_convert_workers(),
+                                                                                 settings.get_convert_niceness()),
+                                             keep_open=True,
+                                             status_callback=self.download_status_changed,
+                                             progress_callback=self.download_progress_changed)
+        # guards the mapping between jobs and download queue positions, held while a job's status
+        # is published so the events of a job are posted in the order they happened
+        self.lock = threading.RLock()
+        self.job_positions = {}
+        self.position_jobs = {}
+        # progress is only kept in memory, writing it to the journal on every update isn't worth it
+        self.progress = {}
+        # one event bus per client streaming events
+        self.subscribers = []
+
+    def start(self):
+        # start the download workers and queue every job that was unfinished when the service stopped
+        self.download_queue.start()
+        for job in self.job_store.get_unfinished_jobs():
+            if job["status"] != 'Queued':
+                self.job_store.update(job["id"], status='Queued')
+            self.resolver.submit(self.resolve_job, job["id"])
+
+    def stop(self):
+        # stop looking up and downloading jobs, jobs being processed are queued again on the next start
+        self.resolver.shutdown(wait=False, cancel_futures=True)
+        self.download_queue.cancel()
+
+    def submit(self, meta_list):
+        # add a job for every stream meta, returns the jobs. Raises ValueError if any meta is invalid
+        meta_list = [self.validate_meta(meta) for meta in meta_list]
+        jobs = []
+        for meta in meta_list:
+            job = self.job_store.add(meta)
+            self.resolver.submit(self.resolve_job, job["id"])
+            self.publish('status', job)
+            jobs.append(job)
+        return jobs
+
+    def validate_meta(self, meta):
+        # returns the stream meta with the default format filled in, same fields as a session file
+        if not isinstance(meta, dict) or not meta.get("url"):
+            raise ValueError("Every job needs a 'url'")
+        chosen_format = meta.get("chosen_format") or self.settings.get_default_file_format()
+        if chosen_format not in self.settings.get_supported_formats():
+            raise ValueError("Unsupported format '%s'" %chosen_format)
+        return {"url": meta["url"],
+                "chosen_format": chosen_format,
+                "start_time": meta.get("start_time") or "",
+                "end_time": meta.get("end_time") or ""}
+
+    def resolve_job(self, job_id):
+        # look up the stream of a job and add it to the download queue, runs in a resolve worker
+        job = self.job_store.get_job(job_id)
+        if job is None or job["status"] != 'Queued':
+            return
+        self.set_job_status(job_id, 'Resolving')
+        if is_playlist_url(job["url"]):
+            self.expand_job(job)
+            return
+        stream = Stream_Generator(job["url"], job["start_time"], job["end_time"],
+                                  self.settings.get_format_type(job["chosen_format"]),
+                                  job["chosen_format"], self.settings.get_download_directory(),
+                                  metadata_cache=self.metadata_cache,
+                                  file_names=self.file_names,
+                                  max_video_height=self.settings.get_max_video_height(),
+                                  max_video_bitrate=self.settings.get_max_video_bitrate())
+        stream.generate()
+        with self.lock:
+            if self.job_store.get_job(job_id)["status"] == 'Cancelled':
+                # cancelled while it was being looked up
+                stream.release_file_path()
+                return
+            if stream.get_errors():
+                stream.release_file_path()
+                self.set_job_status(job_id, 'Error during lookup', error=str(stream.get_errors()))
+                return
+            position = self.download_queue.add(stream)
+            self.job_positions[job_id] = position
+            self.position_jobs[position] = job_id
+            self.set_job_status(job_id, 'Queued for download', title=stream.get_title())
+
+    def expand_job(self, job):
+        # add a job for every video of a playlist or channel job, runs in a resolve worker
+        try:
+            meta_list = expand_stream_meta(job)
+        except Exception as error:
+            self.set_job_status(job["id"], 'Error during lookup', error=get_expand_error(job["url"], error))
+            return
+        with self.lock:
+            if self.job_store.get_job(job["id"])["status"] == 'Cancelled':
+                return
+            jobs = self.submit(meta_list)
+            self.set_job_status(job["id"], 'Expanded', jobs=[item["id"] for item in jobs])
+
+    def cancel(self, job_id):
+        # cancel a job, returns False if the job doesn't exist or has already finished
+        job = self.job_store.get_job(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return False
+        with self.lock:
+            position = self.job_positions.get(job_id)
+            if position is None:
+                # not in the download queue yet, the resolve worker skips it
+                self.set_job_status(job_id, 'Cancelled')
+            else:
+                self.download_queue.cancel_stream(position)
+        return True
+
+    def download_status_changed(self, position, status):
+        # record the status of a job whenever its stream changes status, runs in a worker thread.
+        # Once the final status is in the journal the stream is dropped from the download queue
+        with self.lock:
+            job_id = self.position_jobs.get(position)
+            if job_id is None:
+                return
+            fields = {}
+            if status == 'Done':
+                fields["file_path"] = self.download_queue.get_download_struc()[position]['stream'].get_file_path()
+            if self.download_queue.get_error(position) is not None:
+                fields["error"] = str(self.download_queue.get_error(position))
+            self.set_job_status(job_id, status, **fields)
+            if status in FINISHED_STATUSES:
+                self.forget_position(position)
+
+    def forget_position(self, position):
+        # drop a finished stream from the download queue and the job maps, so a service that runs
+        # for a long time doesn't keep every stream it has downloaded. Must be called holding the lock
+        job_id = self.position_jobs.pop(position)
+        del self.job_positions[job_id]
+        self.progress.pop(job_id, None)
+        self.download_queue.discard(position)
+
+    def download_progress_changed(self, position, progress):
+        # pass the progress of a job on to the clients streaming events, runs in a worker thread
+        with self.lock:
+            job_id = self.position_jobs.get(position)
+            if job_id is None:
+                return
+            self.progress[job_id] = progress
+        self.publish('progress', {"id": job_id, "progress": progress})
+
+    def set_job_status(self, job_id, status, **fields):
+        # change the status of a job and tell the clients streaming events
+        with self.lock:
+            self.job_store.update(job_id, status=status, **fields)
+            self.publish('status', self.job_store.get_job(job_id))
+
+    def get_job(self, job_id):
+        # returns a job with its progress, or None
+        job = self.job_store.get_job(job_id)
+        if job is not None:
+            job["progress"] = self.get_progress(job)
+        return job
+
+    def get_jobs(self):
+        # returns every job with its progress
+        jobs = self.job_store.get_jobs()
+        for job in jobs:
+            job["progress"] = self.get_progress(job)
+        return jobs
+
+    def get_progress(self, job):
+        # returns the progress of a job, the progress of a finished job isn't kept
+        if job["status"] == 'Done':
+            return '100'
+        return self.progress.get(job["id"], '')
+
+    def subscribe(self):
+        # returns an event bus that receives every event until it is unsubscribed
+        event_bus = Event_Bus()
+        with self.lock:
+            self.subscribers.append(event_bus)
+        return event_bus
+
+    def unsubscribe(self, event_bus):
+        # stop sending events to the event bus
+        with self.lock:
+            self.subscribers.remove(event_bus)
+
+    def publish(self, event, job):
+        # post an event about a job to every subscriber, events for the same job are coalesced
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for event_bus in subscribers:
+            event_bus.post(event, job["id"], job)
+
+class Service_Request_Handler(BaseHTTPRequestHandler):
+    """ Handles the HTTP API of the download service:
+            POST   /jobs           submit a job or a list of jobs
+            GET    /jobs           list every job
+            GET    /jobs/<id>      get a single job
+            DELETE /jobs/<id>      cancel a job
+            GET    /events         stream status and progress events as server-sent events """
+    # seconds between checks for new events while streaming them
+    event_interval = 0.25
+    # seconds between comments sent to keep an idle event stream open
+    keepalive_interval = 15
+
+    def do_GET(self):
+        # list jobs, get a single job or stream events
+        if self.path == '/jobs':
+            self.send_json(200, {"jobs": self.server.service.get_jobs()})
+        elif self.path == '/events':
+            self.stream_events()
+        elif self.get_job_id() is not None:
+            job = self.server.service.get_job(self.get_job_id())
+            if job is None:
+                self.send_json(404, {"error": "No such job"})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        # submit jobs, the body is one stream meta object or a list of them
+        if self.path != '/jobs':
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(body, list):
+                body = [body]
+            jobs = self.server.service.submit(body)
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        self.send_json(201, {"jobs": jobs})
+
+    def do_DELETE(self):
+        # cancel a job
+        job_id = self.get_job_id()
+        if job_id is None or self.server.service.get_job(job_id) is None:
+            self.send_json(404, {"error": "No such job"})
+        elif not self.server.service.cancel(job_id):
+            self.send_json(409, {"error": "Job has already finished"})
+        else:
+            self.send_json(200, self.server.service.get_job(job_id))
+
+    def get_job_id(self):
+        # returns the job id in a '/jobs/<id>' path, or None
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs' or not parts[1].isdigit():
+            return None
+        return int(parts[1])
+
+    def send_json(self, code, content):
+        # send a JSON response
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_events(self):
+        # send events as they happen until the client disconnects
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        event_bus = self.server.service.subscribe()
+        last_sent = time.time()
+        try:
+            while True:
+                events = event_bus.drain()
+                for event, key, value in events:
+                    self.wfile.write(("event: %s\ndata: %s\n\n" %(event, json.dumps(value))).encode('utf-8'))
+                if not events and time.time() - last_sent >= self.keepalive_interval:
+                    self.wfile.write(b": keepalive\n\n")
+                    events = True
+                if events:
+                    self.wfile.flush()
+                    last_sent = time.time()
+                time.sleep(self.event_interval)
+        except (IOError, OSError):
+            # the client has disconnected
+            pass
+        finally:
+            self.server.service.unsubscribe(event_bus)
+
+class Service_Server(ThreadingHTTPServer):
+    """ HTTP server for the download service, each connection is handled in its own thread """
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        ThreadingHTTPServer.__init__(self, address, Service_Request_Handler)
+
+def parse_arguments(args):
+    # returns the parsed command line arguments
+    parser = argparse.ArgumentParser(description="Download YouTube videos submitted over a local HTTP API.")
+    parser.add_argument("--host",
+                        help="address to listen on, defaults to the host in the settings")
+    parser.add_argument("-p", "--port", type=int,
+                        help="port to listen on, defaults to the port in the settings")
+    parser.add_argument("--jobs-file",
+                        help="path of the job journal, defaults to the jobs file in the settings")
+    parser.add_argument("--settings", default=SETTINGS_FILE,
+                        help="path of the settings file")
+    return parser.parse_args(args)
+
+def main(args=None):
+    # runs the download service until it is interrupted
+    options = parse_arguments(args)
+    settings = Settings_Parser(options.settings)
+    jobs_file = options.jobs_file or settings.get_service_jobs_file()
+    metadata_cache = Metadata_Cache(settings.get_metadata_cache_file(),
+                                    settings.get_metadata_cache_ttl(),
+                                    settings.get_metadata_cache_size())
+    metrics_writer = None
+    if settings.get_write_metrics():
+        # the timings of every job are kept next to the job journal
+        metrics_writer = Metrics_Writer(get_metrics_file_path(jobs_file), settings.get_prometheus_file())
+    job_store = Job_Store(jobs_file, max_finished_jobs=settings.get_service_max_finished_jobs())
+    service = Download_Service(settings, job_store,
+                               metadata_cache=metadata_cache,
+                               output_cache=Output_Cache(settings.get_output_cache_directory(),
+                                                         settings.get_output_cache_size()),
+                               metrics_writer=metrics_writer)
+    server = Service_Server((options.host or settings.get_service_host(),
+                             options.port or settings.get_service_port()), service)
+    service.start()
+    sys.stderr.write("Listening on http://%s:%s\n" %server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write("Stopping ...\n")
+    server.server_close()
+    service.stop()
+    metadata_cache.save()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())